@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Бенчмарк фильтрации пользователей: построчная проверка против CompiledFilter
+
+Для CompiledFilter в замер входит и разбор ответа API (MemberRecord.from_api,
+где разбирается bdate), а кэш разбора дат перед каждым прогоном очищается -
+сравнение идет от одних и тех же словарей API до результата.
+
+Запуск: python benchmarks/bench_filter.py [--users 100000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot_filters
+from bot_filters import CompiledFilter, MemberRecord
+from bot_state import IdSet
+
+FILTERS = {"age_min": 17, "age_max": 32, "last_seen_days": 10, "has_photo": True}
+
+
+def legacy_filter(users, filters, processed, blacklisted, own_id):
+    """Исходная реализация filter_users_advanced (эталон для сравнения)"""
+    filtered = []
+    for user in users:
+        user_id = user["id"]
+        if user_id in processed or user_id in blacklisted or user_id == own_id:
+            continue
+        if "last_seen" in user:
+            last_seen = datetime.fromtimestamp(user["last_seen"]["time"])
+            days_inactive = (datetime.now() - last_seen).days
+            if days_inactive > filters["last_seen_days"]:
+                continue
+        elif not user.get("online", 0):
+            continue
+        if "bdate" in user and len(user["bdate"].split(".")) == 3:
+            try:
+                birth_date = datetime.strptime(user["bdate"], "%d.%m.%Y")
+                age = (datetime.now() - birth_date).days // 365
+                if age < filters["age_min"] or age > filters["age_max"]:
+                    continue
+            except:
+                pass
+        if filters["has_photo"] and not user.get("has_photo", 0):
+            continue
+        if not user.get("first_name") or not user.get("last_name"):
+            continue
+        if user.get("deactivated"):
+            continue
+        filtered.append(user)
+    return filtered
+
+
+def make_users(count, seed=42):
+    """Синтетические участники групп с разбросом по всем правилам"""
+    rng = random.Random(seed)
+    now = int(time.time())
+    users = []
+    for user_id in range(1, count + 1):
+        user = {"id": user_id, "first_name": "Имя", "last_name": "Фамилия"}
+        if rng.random() < 0.9:
+            # Включая границы ровно в last_seen_days дней
+            user["last_seen"] = {"time": now - rng.randint(0, 20 * 86400)}
+        else:
+            user["online"] = rng.randint(0, 1)
+        roll = rng.random()
+        if roll < 0.6:
+            user["bdate"] = f"{rng.randint(1, 31)}.{rng.randint(1, 12)}.{rng.randint(1980, 2012)}"
+        elif roll < 0.7:
+            user["bdate"] = f"{rng.randint(1, 28)}.{rng.randint(1, 12)}"
+        elif roll < 0.72:
+            user["bdate"] = rng.choice(["31.2.1999", "00.1.2000", " 5.5.2001", "1.1.99"])
+        user["has_photo"] = int(rng.random() < 0.8)
+        if rng.random() < 0.02:
+            user["deactivated"] = "deleted"
+        if rng.random() < 0.01:
+            user["last_name"] = ""
+        users.append(user)
+    return users
+
+
+def timed(func, repeat, setup=None):
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    users = make_users(args.users)
+    processed = IdSet(range(1, args.users, 7))
+    blacklisted = IdSet(range(3, args.users, 101))
+    own_id = 5
+
+    legacy_time, expected = timed(
+        lambda: legacy_filter(users, FILTERS, processed, blacklisted, own_id), args.repeat
+    )
+    compiled = CompiledFilter(FILTERS, (processed, blacklisted), own_id)
+    expected = [user["id"] for user in expected]
+
+    def compiled_run():
+        records = [MemberRecord.from_api(user) for user in users]
+        return [m.id for m in compiled.filter_batch(records)]
+
+    # Холодный кэш дат: в работе бота каждая страница - новые пользователи
+    cold_cache = bot_filters.parse_bdate_ordinal.cache_clear
+
+    numpy_module = bot_filters.np
+    bot_filters.np = None
+    python_time, python_result = timed(compiled_run, args.repeat, cold_cache)
+    bot_filters.np = numpy_module
+
+    print(f"Пользователей: {len(users)}, подходит: {len(expected)}")
+    print(f"Построчно (datetime/strptime):     {legacy_time * 1000:8.1f} мс")
+    print(f"from_api + CompiledFilter, Python: {python_time * 1000:8.1f} мс "
+          f"(x{legacy_time / python_time:.1f})")
+    assert python_result == expected, "результат CompiledFilter (Python) отличается"
+
+    if numpy_module is not None:
+        numpy_time, numpy_result = timed(compiled_run, args.repeat, cold_cache)
+        print(f"from_api + CompiledFilter, NumPy:  {numpy_time * 1000:8.1f} мс "
+              f"(x{legacy_time / numpy_time:.1f})")
+        assert numpy_result == expected, "результат CompiledFilter (NumPy) отличается"
+    else:
+        print("NumPy не установлен - векторный вариант пропущен")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Проверка переноса состояния из старого medical_bot_stats.json
+
+Во временной папке создается файл статистики в исходном формате бота
+(множества пользователей списками прямо в JSON), затем он переносится
+в SQLite так же, как при запуске бота, и загруженное состояние
+сравнивается с исходным. Проверяется и чтение старого файла JSON-хранилищем,
+и запуск с обрезанным файлом: он откладывается в *.corrupt, а хранилище
+создается пустым.
+
+Запуск:
+    python benchmarks/check_migration.py
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from bot_state import JsonStateBackend, create_state_backend
+
+BASELINE_STATS = {
+    "friend_requests_sent": 120,
+    "friend_requests_today": 7,
+    "invites_sent": 40,
+    "invites_today": 3,
+    "groups_found": 2,
+    "last_reset_date": "2024-05-01",
+    "processed_users": [305, 101, 202, 404],
+    "friend_requests": [
+        {"user_id": 101, "timestamp": "2024-04-30T10:00:00"},
+        {"user_id": 202, "timestamp": "2024-05-01T09:30:00"},
+    ],
+    "friends_to_invite": [
+        {"user_id": 305, "ready_since": "2024-05-01T08:00:00"},
+        {"user_id": 404, "ready_since": "2024-05-01T08:05:00"},
+    ],
+    "open_groups": [
+        {"id": 11, "name": "Медколледж", "screen_name": "medcol",
+         "members_count": 5000, "verified_date": "2024-04-01T12:00:00"},
+        {"id": 12, "name": "Будущие врачи", "screen_name": "doctors",
+         "members_count": 8000, "verified_date": "2024-04-02T12:00:00"},
+    ],
+    "blacklisted_users": [909, 808],
+    "successful_invites": 35,
+}
+
+COUNTERS = ("friend_requests_sent", "friend_requests_today", "invites_sent",
+            "invites_today", "groups_found", "last_reset_date", "successful_invites")
+
+
+def compare(stats, source):
+    """Список расхождений загруженного состояния с исходным"""
+    problems = []
+    for key in COUNTERS:
+        if stats[key] != BASELINE_STATS[key]:
+            problems.append(f"{source}: {key} = {stats[key]!r}, ожидалось {BASELINE_STATS[key]!r}")
+    for key in ("processed_users", "blacklisted_users"):
+        if sorted(stats[key]) != sorted(BASELINE_STATS[key]):
+            problems.append(f"{source}: {key} = {sorted(stats[key])}")
+    checks = {
+        "friend_requests": stats["friend_requests"].to_list(),
+        "friends_to_invite": list(stats["friends_to_invite"]),
+        "open_groups": list(stats["open_groups"]),
+    }
+    for key, value in checks.items():
+        if sorted(value, key=json.dumps) != sorted(BASELINE_STATS[key], key=json.dumps):
+            problems.append(f"{source}: {key} = {value}")
+    if len(stats["friends_snapshot"]) != 0:
+        problems.append(f"{source}: непустой снимок друзей")
+    return problems
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="vk_migration_")
+    json_path = os.path.join(workdir, "medical_bot_stats.json")
+    sqlite_path = os.path.join(workdir, "medical_bot_stats.db")
+    problems = []
+    try:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(BASELINE_STATS, f, indent=2, ensure_ascii=False)
+
+        # Старый файл читается JSON-хранилищем как есть
+        problems += compare(JsonStateBackend(json_path).load(), "json")
+
+        # Перенос в SQLite при создании хранилища
+        backend = create_state_backend("sqlite", json_path, sqlite_path)
+        if os.path.exists(json_path) or not os.path.exists(json_path + ".migrated"):
+            problems.append("sqlite: старый файл не переименован в *.migrated")
+        problems += compare(backend.load().load_all(), "sqlite")
+        backend.close()
+
+        # Повторный запуск не переносит заново и читает то же состояние
+        shutil.copy(json_path + ".migrated", json_path)
+        backend = create_state_backend("sqlite", json_path, sqlite_path)
+        if not os.path.exists(json_path):
+            problems.append("sqlite: повторная миграция при существующей базе")
+        problems += compare(backend.load().load_all(), "sqlite (повторно)")
+        backend.close()
+
+        # Обрезанный файл не мешает запуску и не переносится повторно
+        corrupt_path = os.path.join(workdir, "corrupt_stats.json")
+        corrupt_sqlite_path = os.path.join(workdir, "corrupt_stats.db")
+        with open(corrupt_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(BASELINE_STATS)[:100])
+        try:
+            backend = create_state_backend("sqlite", corrupt_path, corrupt_sqlite_path)
+        except Exception as e:
+            problems.append(f"sqlite (поврежденный файл): ошибка при запуске: {e!r}")
+        else:
+            if os.path.exists(corrupt_path) or not os.path.exists(corrupt_path + ".corrupt"):
+                problems.append("sqlite (поврежденный файл): не переименован в *.corrupt")
+            if backend.exists():
+                problems.append("sqlite (поврежденный файл): хранилище не пустое")
+            backend.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        return 1
+    print("✅ Миграция состояния: все данные перенесены")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
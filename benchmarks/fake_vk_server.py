@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Локальная замена VK API для бенчмарков
+
+Отвечает на users.get, groups.search, groups.getById, groups.getMembers,
+friends.get, friends.add, groups.invite и execute синтетическими данными.
+Участники групп не хранятся, а вычисляются по (group_id, offset), поэтому
+группы на 1M участников не занимают память. Можно подмешивать ошибки API.
+
+Самостоятельный запуск: python benchmarks/fake_vk_server.py --port 8765
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+OWN_USER_ID = 1
+MEMBER_ID_STRIDE = 10_000_000
+# Группы из поиска лежат в отдельном диапазоне id и получают собственный размер
+SEARCH_GROUP_BASE = 1_000_000
+
+
+def mix(value):
+    """Быстрый детерминированный хэш (splitmix64)"""
+    value = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+
+class ApiFailure(Exception):
+    def __init__(self, code, message, **extra):
+        super().__init__(message)
+        self.error = dict({"error_code": code, "error_msg": message}, **extra)
+
+
+class FakeVkData:
+    """Синтетические данные и состояние фейкового API"""
+
+    def __init__(self, members_per_group=10_000, accept_rate=0.3, seed=1,
+                 now=None, errors=None):
+        self.members_per_group = members_per_group
+        self.accept_rate = accept_rate
+        self.seed = seed
+        self.now = int(now or time.time())
+        # {method: [(вероятность, код ошибки), ...]}
+        self.errors = errors or {}
+        self.rng = random.Random(seed)
+        self.friends = set()
+        self.requested = set()
+        self.invited = set()
+        self.calls = {}          # вызовы методов, включая вызовы внутри execute
+        self.http_requests = 0
+        self.lock = threading.Lock()
+
+    # --- Синтетические сущности ---
+
+    def group_id_for(self, identifier):
+        identifier = str(identifier).strip().rstrip("/").split("/")[-1].lower()
+        for prefix in ("club", "public"):
+            if identifier.startswith(prefix) and identifier[len(prefix):].isdigit():
+                return int(identifier[len(prefix):])
+        if identifier.isdigit():
+            return int(identifier)
+        return 100 + mix(zlib.crc32(identifier.encode("utf-8"))) % 900_000
+
+    def group(self, group_id):
+        h = mix(group_id ^ self.seed)
+        if group_id >= SEARCH_GROUP_BASE:
+            # Размер в окне, которое принимает discover_open_medical_groups
+            members_count = 501 + (h >> 8) % 99_498
+        else:
+            members_count = self.members_per_group
+        return {
+            "id": group_id,
+            "name": f"Медицинская группа {group_id}",
+            "screen_name": f"club{group_id}",
+            "is_closed": 1 if h % 5 == 0 else 0,
+            "type": "group",
+            "members_count": members_count if h % 5 else 100 + h % 1000,
+            "activity": "Медицина",
+        }
+
+    def group_is_denied(self, group_id):
+        h = mix(group_id ^ self.seed)
+        return h % 5 == 0 or h % 11 == 0
+
+    def member(self, user_id, fields):
+        h = mix(user_id ^ self.seed)
+        user = {"id": user_id, "first_name": "Имя", "last_name": "Фамилия" if h % 97 else ""}
+        if h % 53 == 0:
+            user["deactivated"] = "deleted"
+        if "last_seen" in fields and h % 10:
+            user["last_seen"] = {"time": self.now - (h >> 8) % (30 * 86400), "platform": 7}
+        if "online" in fields:
+            user["online"] = int((h >> 16) % 7 == 0)
+        if "bdate" in fields and (h >> 20) % 10 < 7:
+            day, month, year = 1 + (h >> 24) % 28, 1 + (h >> 32) % 12, 1975 + (h >> 40) % 40
+            user["bdate"] = f"{day}.{month}.{year}" if (h >> 48) % 10 else f"{day}.{month}"
+        if "has_photo" in fields:
+            user["has_photo"] = int((h >> 52) % 5 != 0)
+        for field in ("sex", "city", "connections"):
+            if field in fields:
+                user[field] = {"id": 1, "title": "Москва"} if field == "city" else 1
+        return user
+
+    # --- Методы API ---
+
+    def call(self, method, params):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            for probability, code in self.errors.get(method, ()):
+                if self.rng.random() < probability:
+                    raise self.make_error(code)
+
+        handler = getattr(self, "m_" + method.replace(".", "_"), None)
+        if handler is None:
+            raise ApiFailure(3, "Unknown method passed")
+        return handler(params)
+
+    def make_error(self, code):
+        messages = {
+            6: "Too many requests per second",
+            9: "Flood control",
+            14: "Captcha needed",
+            15: "Access denied",
+            29: "Rate limit reached",
+            175: "Cannot add this user to friends as they have put you on their blacklist",
+            203: "Access to group denied",
+        }
+        extra = {}
+        if code == 14:
+            extra = {"captcha_sid": "1", "captcha_img": "https://example.invalid/captcha.png"}
+        return ApiFailure(code, messages.get(code, "Unknown error"), **extra)
+
+    def m_users_get(self, params):
+        return [{"id": OWN_USER_ID, "first_name": "Бот", "last_name": "Бенчмарк"}]
+
+    def m_groups_search(self, params):
+        h = mix(zlib.crc32(params.get("q", "").encode("utf-8")))
+        count = int(params.get("count", 20))
+        items = [self.group(SEARCH_GROUP_BASE + (h + i * 7919) % 500_000) for i in range(count)]
+        return {"count": len(items), "items": items}
+
+    def m_groups_getById(self, params):
+        raw = params.get("group_ids") or params.get("group_id") or ""
+        return [self.group(self.group_id_for(g)) for g in str(raw).split(",") if g]
+
+    def m_groups_getMembers(self, params):
+        group_id = self.group_id_for(params["group_id"])
+        if self.group_is_denied(group_id):
+            raise ApiFailure(203, "Access to group denied")
+
+        total = self.group(group_id)["members_count"]
+        offset = int(params.get("offset", 0))
+        count = min(int(params.get("count", 1000)), 1000)
+        fields = set(str(params.get("fields", "")).split(","))
+        base = group_id * MEMBER_ID_STRIDE
+        items = [
+            self.member(base + i, fields) if fields != {""} else base + i
+            for i in range(offset, min(offset + count, total))
+        ]
+        return {"count": total, "items": items}
+
+    def m_friends_get(self, params):
+        friends = sorted(self.friends)
+        offset = int(params.get("offset", 0))
+        count = int(params.get("count", 5000))
+        return {"count": len(friends), "items": friends[offset:offset + count]}
+
+    def m_friends_add(self, params):
+        user_id = int(params["user_id"])
+        with self.lock:
+            self.requested.add(user_id)
+            # Часть заявок принимается сразу
+            if mix(user_id) % 1000 < self.accept_rate * 1000:
+                self.friends.add(user_id)
+        return 1
+
+    def m_groups_invite(self, params):
+        with self.lock:
+            self.invited.add(int(params["user_id"]))
+        return 1
+
+    def m_execute(self, params):
+        """Разбор кода, который формирует vk_api.VkRequestsPool"""
+        code = params["code"]
+        calls = []
+        match = re.search(r"var values = (\[.*?\]),\s*i = 0", code, re.S)
+        if match:
+            method = re.search(r"API\.([\w.]+)\(values\[i\]\)", code).group(1)
+            calls = [(method, values) for values in json.loads(match.group(1))]
+        else:
+            decoder = json.JSONDecoder()
+            for found in re.finditer(r"API\.([\w.]+)\(", code):
+                values, _ = decoder.raw_decode(code, found.end())
+                calls.append((found.group(1), values))
+
+        response, errors = [], []
+        for method, values in calls:
+            try:
+                response.append(self.call(method, values))
+            except ApiFailure as e:
+                response.append(False)
+                errors.append(dict(e.error, method=method))
+        return {"__raw__": True, "response": response, "execute_errors": errors}
+
+
+class FakeVkHandler(BaseHTTPRequestHandler):
+    data = None  # FakeVkData, задается в make_server
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        params = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        with self.data.lock:
+            self.data.http_requests += 1
+
+        try:
+            result = self.data.call(method, params)
+            if isinstance(result, dict) and result.pop("__raw__", False):
+                body = result
+            else:
+                body = {"response": result}
+        except ApiFailure as e:
+            body = {"error": dict(e.error, request_params=[])}
+
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(data, host="127.0.0.1", port=0):
+    """Сервер в отдельном потоке; адрес - server.server_address"""
+    handler = type("BoundFakeVkHandler", (FakeVkHandler,), {"data": data})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def parse_error_spec(spec):
+    """"friends.add:0.05:9" -> ("friends.add", 0.05, 9)"""
+    method, probability, code = spec.split(":")
+    return method, float(probability), int(code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--members", type=int, default=10_000)
+    parser.add_argument("--inject", action="append", default=[],
+                        help="ошибка вида method:вероятность:код, можно несколько")
+    args = parser.parse_args()
+
+    errors = {}
+    for spec in args.inject:
+        method, probability, code = parse_error_spec(spec)
+        errors.setdefault(method, []).append((probability, code))
+
+    server = make_server(FakeVkData(args.members, errors=errors), port=args.port)
+    print(f"Фейковый VK API: http://{server.server_address[0]}:{server.server_address[1]}/method/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
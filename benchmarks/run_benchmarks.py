@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Офлайн бенчмарк VKMedicalBot на фейковом VK API
+
+Бот запускается целиком, но все запросы уходят в локальный сервер
+(benchmarks/fake_vk_server.py), а time.sleep заменен виртуальными часами:
+паузы не ждутся, а только суммируются. Для каждого размера группы
+измеряются время и пик памяти фаз: загрузка/сохранение состояния,
+загрузка и фильтрация участников, сверка друзей, поиск групп и полный цикл.
+
+Запуск:
+    python benchmarks/run_benchmarks.py --sizes 10000,100000,1000000
+    python benchmarks/run_benchmarks.py --inject friends.add:0.05:9 --json result.json
+"""
+
+import argparse
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time as real_time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import requests
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_vk_server import FakeVkData, make_server, mix, parse_error_spec
+
+
+class VirtualClock:
+    """Замена модуля time: sleep() не ждет, а сдвигает виртуальное время"""
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.offset += seconds
+
+    def time(self):
+        return real_time.time() + self.offset
+
+    def monotonic(self):
+        return real_time.monotonic() + self.offset
+
+    def __getattr__(self, name):
+        return getattr(real_time, name)
+
+
+class RedirectAdapter(requests.adapters.HTTPAdapter):
+    """Перенаправляет https://api.vk.com/method/* на локальный сервер"""
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace("https://api.vk.com/method/", self.base_url, 1)
+        return super().send(request, **kwargs)
+
+
+def patch_vk_api(base_url):
+    """Все сессии vk_api ходят в фейковый сервер"""
+    import vk_api
+
+    original_init = vk_api.VkApi.__init__
+
+    def init(self, *args, **kwargs):
+        original_init(self, *args, **kwargs)
+        self.http.mount("https://api.vk.com/", RedirectAdapter(base_url))
+
+    vk_api.VkApi.__init__ = init
+    return lambda: setattr(vk_api.VkApi, "__init__", original_init)
+
+
+def install_clock(clock):
+    """Подмена time во всех модулях, которые спят или смотрят на часы"""
+    import vk_api.vk_api
+
+    modules = [vk_api.vk_api]
+    for name in list(sys.modules):
+        if name == "vk_medical_bot" or name.startswith("bot_"):
+            modules.append(sys.modules[name])
+    for module in modules:
+        current = getattr(module, "time", None)
+        if current is real_time or isinstance(current, VirtualClock):
+            module.time = clock
+
+
+def find_open_groups(data, count, start=1000):
+    """ID групп, которые фейковый API отдает как открытые и доступные"""
+    groups = []
+    group_id = start
+    while len(groups) < count:
+        info = data.group(group_id)
+        if not info["is_closed"] and not data.group_is_denied(group_id):
+            groups.append(info)
+        group_id += 1
+    return groups
+
+
+def seed_state(data, size, open_groups, invite_after_hours):
+    """Начальное состояние заданного размера прямо в хранилище"""
+    from bot_state import FriendsSnapshot, IdSet, PendingRequests, create_state_backend
+
+    old = (datetime.now() - timedelta(hours=invite_after_hours + 1)).isoformat()
+    pending_ids = range(2, 2 + size // 10)
+    stats = {
+        "friend_requests_sent": size,
+        "friend_requests_today": 0,
+        "invites_sent": 0,
+        "invites_today": 0,
+        "groups_found": len(open_groups),
+        "last_reset_date": datetime.now().strftime("%Y-%m-%d"),
+        "processed_users": IdSet(range(10_000_000, 10_000_000 + size)),
+        "blacklisted_users": IdSet(range(20_000_000, 20_000_000 + size // 100)),
+        "friend_requests": PendingRequests(
+            {"user_id": user_id, "timestamp": old} for user_id in pending_ids
+        ),
+        "friends_to_invite": [],
+        "friends_snapshot": FriendsSnapshot(),
+        "open_groups": [
+            {"id": g["id"], "name": g["name"], "screen_name": g["screen_name"],
+             "members_count": g["members_count"], "verified_date": old}
+            for g in open_groups
+        ],
+        "successful_invites": 0,
+    }
+    backend = create_state_backend(
+        os.environ["STATE_BACKEND"], "medical_bot_stats.json", "medical_bot_stats.db"
+    )
+    backend.import_stats(stats)
+    backend.close()
+
+    # Часть ожидающих заявок уже принята
+    data.friends = {user_id for user_id in pending_ids if mix(user_id) % 10 < 3}
+
+
+class PhaseRecorder:
+    def __init__(self, clock, data, track_memory):
+        self.clock = clock
+        self.data = data
+        self.track_memory = track_memory
+        self.rows = []
+
+    def run(self, name, func):
+        calls_before = sum(self.data.calls.values())
+        requests_before = self.data.http_requests
+        virtual_before = self.clock.offset
+        if self.track_memory:
+            tracemalloc.start()
+        start = real_time.perf_counter()
+        try:
+            result = func()
+        finally:
+            elapsed = real_time.perf_counter() - start
+            peak = 0
+            if self.track_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        self.rows.append({
+            "phase": name,
+            "seconds": round(elapsed, 4),
+            "peak_mb": round(peak / 1024 / 1024, 2),
+            "virtual_sleep_s": round(self.clock.offset - virtual_before, 1),
+            "api_calls": sum(self.data.calls.values()) - calls_before,
+            "http_requests": self.data.http_requests - requests_before,
+        })
+        return result
+
+
+def bench_size(size, args):
+    workdir = tempfile.mkdtemp(prefix="vk_bench_")
+    old_cwd = os.getcwd()
+    os.chdir(workdir)
+
+    errors = {}
+    for spec in args.inject:
+        method, probability, code = parse_error_spec(spec)
+        errors.setdefault(method, []).append((probability, code))
+    data = FakeVkData(members_per_group=size, errors=errors)
+    server = make_server(data)
+    host, port = server.server_address
+    unpatch = patch_vk_api(f"http://{host}:{port}/method/")
+
+    os.environ.update({
+        "VK_ACCESS_TOKEN": "benchmark-token",
+        "YOUR_GROUP_ID": "1",
+        "STATE_BACKEND": args.backend,
+        "MIN_DELAY": "45",
+        "MAX_DELAY": "120",
+        "INVITE_AFTER_HOURS": "4",
+        "MAX_FRIEND_REQUESTS_PER_DAY": "50",
+        "MAX_INVITES_PER_DAY": "40",
+    })
+
+    try:
+        bot_module = importlib.import_module("vk_medical_bot")
+        import logging
+        logging.getLogger("VK_Medical_Bot").setLevel(logging.WARNING)
+
+        clock = VirtualClock()
+        install_clock(clock)
+
+        open_groups = find_open_groups(data, 10)
+        seed_state(data, size, open_groups, invite_after_hours=4)
+
+        phases = PhaseRecorder(clock, data, track_memory=not args.no_memory)
+        bot = phases.run("startup", bot_module.VKMedicalBot)
+        # При быстром старте коллекции грузятся лениво - замеряем полную загрузку
+        def full_state_load():
+            bot.load_stats()
+            bot.stats.load_all()
+        phases.run("state_load", full_state_load)
+        phases.run("state_save", bot.save_stats)
+
+        def incremental_updates():
+            for user_id in range(30_000_000, 30_001_000):
+                bot.stats["processed_users"].add(user_id)
+                bot.state.add_processed_user(user_id)
+        phases.run("state_1000_upserts", incremental_updates)
+
+        def members_and_filter():
+            user_filter = bot.compile_user_filter()
+            loaded = matched = 0
+            for page, raw_count in bot.iter_group_member_pages(open_groups[0]["id"], max_count=size):
+                loaded += raw_count
+                matched += len(bot.filter_users_batch(page, user_filter))
+            return loaded, matched
+        loaded, matched = phases.run("members_fetch_filter", members_and_filter)
+
+        phases.run("reconciliation", bot.check_new_friends)
+        # Повторный проход по тем же ключевым словам: видно, сколько
+        # запросов экономят индекс проверенных групп и кэш групп
+        keyword_cursor = bot.discovery_index.keyword_cursor
+        phases.run("discovery_cold", bot.discover_open_medical_groups)
+        bot.discovery_index.keyword_cursor = keyword_cursor
+        phases.run("discovery_warm", bot.discover_open_medical_groups)
+        phases.run("run_cycle", bot.run_cycle)
+        bot.state.close()
+
+        return {
+            "size": size,
+            "members_loaded": loaded,
+            "members_matched": matched,
+            "phases": phases.rows,
+            "api_calls": dict(data.calls),
+        }
+    finally:
+        unpatch()
+        server.shutdown()
+        os.chdir(old_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(result):
+    print(f"\n=== Размер группы: {result['size']} "
+          f"(загружено {result['members_loaded']}, подходит {result['members_matched']}) ===")
+    print(f"{'фаза':<24}{'время, с':>10}{'пик, МБ':>10}{'паузы, с':>11}"
+          f"{'вызовов':>10}{'HTTP':>8}")
+    for row in result["phases"]:
+        print(f"{row['phase']:<24}{row['seconds']:>10.3f}{row['peak_mb']:>10.2f}"
+              f"{row['virtual_sleep_s']:>11.1f}{row['api_calls']:>10}{row['http_requests']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000",
+                        help="размеры групп через запятую (10000..1000000)")
+    parser.add_argument("--backend", default="sqlite", choices=("sqlite", "json"))
+    parser.add_argument("--inject", action="append", default=[],
+                        help="ошибка API вида method:вероятность:код, можно несколько")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="не отслеживать память (tracemalloc замедляет фазы)")
+    parser.add_argument("--json", help="сохранить результаты в JSON файл")
+    args = parser.parse_args()
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        result = bench_size(size, args)
+        print_report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
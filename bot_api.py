@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Обертки над VK API: регулятор частоты запросов и пакетные запросы"""
+
+import logging
+import random
+import time
+
+import requests
+from vk_api.exceptions import ApiError, ApiHttpError, Captcha
+from vk_api.requests_pool import vk_many_methods
+from vk_api.vk_api import VkApiMethod
+
+logger = logging.getLogger("VK_Medical_Bot")
+
+# Коды ошибок VK API -> вид ошибки
+ERROR_KINDS = {
+    1: "transient",            # Unknown error
+    6: "too_many_requests",    # Слишком много запросов в секунду
+    9: "flood",                # Флуд-контроль на действие
+    10: "transient",           # Внутренняя ошибка сервера
+    14: "captcha",
+    15: "access",
+    29: "rate_limit",          # Исчерпан лимит вызовов метода
+    175: "blacklist",          # Пользователь добавил нас в черный список
+    176: "blacklist",          # Пользователь в нашем черном списке
+    203: "access",             # Нет доступа к группе
+}
+
+# Ошибки, после которых запрос повторяется после короткой паузы
+RETRY_KINDS = ("too_many_requests", "transient")
+
+# Ошибки, после которых метод блокируется на время
+BLOCKING_KINDS = ("flood", "rate_limit", "captcha")
+
+
+def error_code(error):
+    """Числовой код ошибки VK API или None"""
+    if isinstance(error, Captcha):
+        return 14
+    if isinstance(error, ApiError):
+        return error.code
+    return None
+
+
+def classify_error(error):
+    """Вид ошибки: too_many_requests, flood, captcha, rate_limit, access,
+    blacklist, transient, throttled (запрос не отправлялся) или other"""
+    if isinstance(error, ApiThrottled):
+        return "throttled"
+    if isinstance(error, (ApiHttpError, requests.RequestException)):
+        return "transient"
+    return ERROR_KINDS.get(error_code(error), "other")
+
+
+class ApiThrottled(Exception):
+    """Запрос не отправлен: метод заблокирован регулятором"""
+
+    def __init__(self, method, kind, until):
+        super().__init__(method, kind, until)
+        self.method = method
+        self.kind = kind
+        self.until = until
+
+    def __str__(self):
+        minutes = max(0, self.until - time.time()) / 60
+        return f"{self.method} приостановлен ({self.kind}) еще на {minutes:.0f} мин"
+
+
+class RateGovernor:
+    """Единая точка вызова VK API
+
+    Все запросы идут через token bucket емкостью в один запрос: между
+    запросами не меньше 1 / requests_per_second секунды, без всплесков.
+    По умолчанию 2.8 в секунду - чуть ниже лимита VK (3), чтобы разброс
+    задержек в сети не давал ошибку 6.
+    Ошибки разбираются по кодам: при 6 и внутренних ошибках запрос
+    повторяется с экспоненциальной паузой, при флуд-контроле (9) и
+    исчерпанном лимите (29) метод блокируется с нарастающей паузой,
+    при капче (14) действие останавливается на captcha_halt секунд
+    без повторов. Ко всем паузам добавляется случайный разброс.
+
+    Метод method() совместим с vk_api.VkApi.method. Если передан
+    metrics (bot_metrics.Metrics), учитываются задержки и ошибки запросов.
+    """
+
+    # Базовые паузы, секунды
+    RETRY_BASE_DELAY = 1
+    RATE_LIMIT_DELAY = 3600
+    MAX_BLOCK = 24 * 3600
+
+    def __init__(self, vk_session, requests_per_second=2.8, flood_backoff=600,
+                 captcha_halt=6 * 3600, max_retries=3, metrics=None):
+        self.vk_session = vk_session
+        self.metrics = metrics
+        self.rate = float(requests_per_second)
+        # Больше одного токена дало бы пачку запросов сверх лимита в секунду
+        self.capacity = 1.0
+        self.flood_backoff = flood_backoff
+        self.captcha_halt = captcha_halt
+        self.max_retries = max_retries
+
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked = {}   # method -> (until, kind)
+        self._failures = {}  # method -> ошибок подряд
+
+        # Паузы и повторы при ошибке 6 теперь делает регулятор
+        vk_session.RPS_DELAY = 0
+        vk_session.error_handlers.pop(6, None)
+
+    def _take_token(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        if self._tokens < 1:
+            wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            self._updated = time.monotonic()
+            self._tokens = 1
+        self._tokens -= 1
+
+    @staticmethod
+    def _jitter(delay):
+        return delay * random.uniform(0.8, 1.2)
+
+    def blocked(self, method):
+        """(until, kind), если метод сейчас заблокирован, иначе None"""
+        block = self._blocked.get(method)
+        if block is None:
+            return None
+        if block[0] <= time.time():
+            del self._blocked[method]
+            return None
+        return block
+
+    def available(self, method):
+        return self.blocked(method) is None
+
+    def check(self, method):
+        """ApiThrottled, если метод заблокирован"""
+        block = self.blocked(method)
+        if block is not None:
+            raise ApiThrottled(method, block[1], block[0])
+
+    def record_error(self, method, error):
+        """Учет ошибки метода (в том числе из execute), возвращает вид ошибки"""
+        kind = classify_error(error)
+        if kind not in RETRY_KINDS and kind not in BLOCKING_KINDS:
+            return kind
+
+        failures = self._failures.get(method, 0)
+        self._failures[method] = failures + 1
+
+        if kind == "captcha":
+            delay = self.captcha_halt
+            logger.warning(f"🤖 Капча в {method}! Действие остановлено на {delay / 3600:.1f} ч")
+        elif kind == "flood":
+            delay = self._jitter(min(self.MAX_BLOCK, self.flood_backoff * 2 ** failures))
+            logger.warning(f"🌊 Флуд-контроль в {method}! Пауза {delay / 60:.0f} мин")
+        elif kind == "rate_limit":
+            delay = self._jitter(min(self.MAX_BLOCK, self.RATE_LIMIT_DELAY * 2 ** failures))
+            logger.warning(f"⛔ Лимит вызовов {method} исчерпан! Пауза {delay / 60:.0f} мин")
+        else:
+            # Короткие паузы перед повтором ждем на месте
+            if kind == "too_many_requests":
+                self._tokens = 0
+            return kind
+
+        self._blocked[method] = (time.time() + delay, kind)
+        return kind
+
+    def get_api(self):
+        """VkApiMethod поверх регулятора: vk.friends.add(...) и т.п."""
+        return VkApiMethod(self)
+
+    def method(self, method, values=None, raw=False):
+        """Вызов метода API (интерфейс vk_api.VkApi.method)"""
+        for attempt in range(self.max_retries + 1):
+            self.check(method)
+            self._take_token()
+            start = time.perf_counter()
+            try:
+                result = self.vk_session.method(method, values, raw=raw)
+            except Exception as e:
+                kind = self.record_error(method, e)
+                if self.metrics is not None:
+                    self.metrics.observe_call(
+                        method, time.perf_counter() - start, error_code(e) or kind
+                    )
+                if kind not in RETRY_KINDS or attempt == self.max_retries:
+                    raise
+                delay = self._jitter(self.RETRY_BASE_DELAY * 2 ** attempt)
+                logger.warning(f"⏳ {method}: {e}, повтор через {delay:.1f} с")
+                time.sleep(delay)
+                continue
+
+            if self.metrics is not None:
+                self.metrics.observe_call(method, time.perf_counter() - start)
+            self._failures.pop(method, None)
+            return result
+
+
+class BatchResult:
+    """Результат одного запроса из пакета"""
+
+    __slots__ = ("method", "values", "result", "error")
+
+    def __init__(self, method, values, result=None, error=None):
+        self.method = method
+        self.values = values
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class ApiBatcher:
+    """Пакетное выполнение read-only запросов через метод execute
+
+    До 25 вызовов уходят одним HTTPS запросом (и одним запросом из
+    лимита API). Ошибки возвращаются отдельно для каждого вызова.
+    Если execute недоступен, запросы выполняются по одному.
+    Запросы идут через RateGovernor, ошибки отдельных вызовов
+    тоже учитываются регулятором.
+    """
+
+    MAX_BATCH = 25
+
+    def __init__(self, governor, enabled=True):
+        self.governor = governor
+        self.enabled = enabled
+
+    def call_many(self, calls):
+        """calls: [(method, values), ...] -> [BatchResult, ...] в том же порядке"""
+        results = [BatchResult(method, dict(values)) for method, values in calls]
+
+        # Заблокированные методы не отправляем
+        for item in results:
+            try:
+                self.governor.check(item.method)
+            except ApiThrottled as e:
+                item.error = e
+        pending = [item for item in results if item.error is None]
+        if not pending:
+            return results
+
+        if self.enabled and len(pending) > 1:
+            try:
+                self._execute(pending)
+            except Exception as e:
+                logger.warning(f"⚠️ Пакетный запрос не выполнен, запросы по одному: {e}")
+
+        # По одному - то, что не выполнилось пакетом или упало с временной ошибкой
+        for item in pending:
+            if item.error is not None and classify_error(item.error) in RETRY_KINDS:
+                item.error = None
+            if item.result is None and item.error is None:
+                self._call_one(item)
+        return results
+
+    def _execute(self, results):
+        for i in range(0, len(results), self.MAX_BATCH):
+            chunk = results[i:i + self.MAX_BATCH]
+            # Код execute как у VkRequestsPool, но запрос идет через регулятор
+            response = vk_many_methods(self.governor, chunk)
+            errors = iter(response.get("execute_errors", []))
+            metrics = self.governor.metrics
+
+            for item, result in zip(chunk, response["response"]):
+                if result is not False:
+                    item.result = result
+                else:
+                    item.error = ApiError(
+                        self.governor, item.method, item.values, False, next(errors)
+                    )
+                    self.governor.record_error(item.method, item.error)
+                if metrics is not None:
+                    metrics.observe_batched(item.method, item.error and error_code(item.error))
+
+    def _call_one(self, item):
+        try:
+            item.result = self.governor.method(item.method, item.values)
+        except Exception as e:
+            item.error = e
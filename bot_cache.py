@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Кэши ответов VK API"""
+
+import json
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+
+from bot_filters import MemberRecord
+
+
+def normalize_group_identifier(group_identifier):
+    """Ссылка, короткое имя или ID группы -> ID (int) или короткое имя"""
+    if isinstance(group_identifier, int):
+        return group_identifier
+
+    identifier = str(group_identifier).strip().rstrip("/")
+    for prefix in ("https://", "http://", "m.vk.com/", "vk.com/"):
+        if identifier.startswith(prefix):
+            identifier = identifier[len(prefix):]
+    identifier = identifier.lower()
+
+    # club123 / public123 - это ссылки на ID
+    for prefix in ("club", "public"):
+        if identifier.startswith(prefix) and identifier[len(prefix):].isdigit():
+            return int(identifier[len(prefix):])
+
+    if identifier.isdigit():
+        return int(identifier)
+    return identifier
+
+
+class GroupCache:
+    """Кэш метаданных групп с TTL на запись и вытеснением LRU
+
+    Хранит для каждой группы ID, короткое имя, название, число участников
+    и результат проверки доступности. Записи сохраняются в хранилище
+    состояния и переживают перезапуск.
+    """
+
+    NAMESPACE = "group_cache"
+
+    def __init__(self, backend, ttl_seconds, max_entries):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # group_id -> entry
+        self._aliases = {}             # screen_name -> group_id
+
+        now = time.time()
+        records = backend.load_records(self.NAMESPACE)
+        for entry in sorted(records.values(), key=lambda e: e.get("checked_at", 0)):
+            if entry.get("expires_at", 0) > now:
+                self._remember(entry)
+            else:
+                backend.delete_record(self.NAMESPACE, entry["id"])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, entry):
+        group_id = entry["id"]
+        self._entries[group_id] = entry
+        self._entries.move_to_end(group_id)
+        for alias in [entry.get("screen_name")] + entry.get("aliases", []):
+            if alias:
+                self._aliases[alias.lower()] = group_id
+
+    def _forget(self, group_id):
+        entry = self._entries.pop(group_id, None)
+        if entry is not None:
+            for alias in [entry.get("screen_name")] + entry.get("aliases", []):
+                if alias:
+                    self._aliases.pop(alias.lower(), None)
+        self.backend.delete_record(self.NAMESPACE, group_id)
+
+    def get(self, group_identifier):
+        """Свежая запись о группе или None"""
+        key = normalize_group_identifier(group_identifier)
+        group_id = key if isinstance(key, int) else self._aliases.get(key)
+        entry = self._entries.get(group_id)
+        if entry is None:
+            return None
+
+        if entry["expires_at"] <= time.time():
+            self._forget(group_id)
+            return None
+
+        self._entries.move_to_end(group_id)
+        return entry
+
+    def put(self, group_info, accessible=None, alias=None):
+        """Сохранение ответа groups.getById (и результата проверки доступа)
+
+        alias - имя, по которому группу запрашивали, если оно отличается
+        от screen_name (старое короткое имя, ссылка и т.п.)
+        """
+        now = time.time()
+        previous = self._entries.get(group_info["id"], {})
+        aliases = list(previous.get("aliases", []))
+        if isinstance(alias, str) and alias != group_info.get("screen_name") and alias not in aliases:
+            aliases.append(alias)
+        entry = {
+            "id": group_info["id"],
+            "name": group_info.get("name", previous.get("name", f"ID{group_info['id']}")),
+            "screen_name": group_info.get("screen_name", previous.get("screen_name", "")),
+            "members_count": group_info.get("members_count", previous.get("members_count", 0)),
+            "is_closed": group_info.get("is_closed", previous.get("is_closed")),
+            "accessible": accessible if accessible is not None else previous.get("accessible"),
+            "aliases": aliases,
+            "checked_at": now,
+            "expires_at": now + self.ttl_seconds,
+        }
+        self._remember(entry)
+        self.backend.put_record(self.NAMESPACE, entry["id"], entry)
+
+        while len(self._entries) > self.max_entries:
+            oldest_id = next(iter(self._entries))
+            self._forget(oldest_id)
+
+        return entry
+
+
+class DiscoveryIndex:
+    """Индекс уже проверенных при поиске групп
+
+    Для каждой группы хранит статус (verified / rejected), причину отказа
+    и время проверки. Отказы (закрытые, недоступные, неподходящего размера)
+    - отрицательный кэш: они не проверяются повторно, пока не истечет TTL.
+    Также хранит позицию ротации ключевых слов между запусками.
+    """
+
+    NAMESPACE = "discovery_index"
+    META_NAMESPACE = "discovery_meta"
+
+    def __init__(self, backend, negative_ttl_seconds):
+        self.backend = backend
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries = {}
+        for group_id, entry in backend.load_records(self.NAMESPACE).items():
+            self._entries[int(group_id)] = entry
+            if not self.is_known(int(group_id)):
+                # Истекшие отказы больше не нужны
+                del self._entries[int(group_id)]
+                backend.delete_record(self.NAMESPACE, group_id)
+        meta = backend.load_records(self.META_NAMESPACE)
+        self.keyword_cursor = meta.get("keyword_cursor", 0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_known(self, group_id):
+        """Группа уже проверена, и результат еще действителен"""
+        entry = self._entries.get(group_id)
+        if entry is None:
+            return False
+        if entry["status"] == "verified":
+            return True
+        return entry["checked_at"] + self.negative_ttl_seconds > time.time()
+
+    def _mark(self, group_id, status, reason=None):
+        entry = {
+            "status": status,
+            "reason": reason,
+            "checked_at": time.time(),
+        }
+        self._entries[group_id] = entry
+        self.backend.put_record(self.NAMESPACE, group_id, entry)
+
+    def verify(self, group_id):
+        self._mark(group_id, "verified")
+
+    def reject(self, group_id, reason):
+        self._mark(group_id, "rejected", reason)
+
+    def next_keywords(self, keywords, count):
+        """Очередная порция ключевых слов (по кругу между запусками)"""
+        if not keywords:
+            return []
+        count = min(count, len(keywords))
+        start = self.keyword_cursor % len(keywords)
+        selected = [keywords[(start + i) % len(keywords)] for i in range(count)]
+
+        self.keyword_cursor = (start + count) % len(keywords)
+        self.backend.put_record(self.META_NAMESPACE, "keyword_cursor", self.keyword_cursor)
+        return selected
+
+
+class MemberPageCache:
+    """Дисковый кэш страниц groups.getMembers
+
+    Ключ - (group_id, offset, count, fields). Страница хранится уже в виде
+    MemberRecord (сжатый JSON) и без пользователей, которые на момент
+    загрузки были в excluded_sets (обработанные, черный список).
+    При чтении исключенные с тех пор пользователи тоже отбрасываются.
+
+    Истекшая страница не загружается заново, если число участников
+    группы не изменилось с момента загрузки - ее срок продлевается,
+    но не дольше max_age. Число участников передается функцией, которая
+    вызывается только для истекших страниц (чтобы получить свежее значение
+    с сервера лишь тогда, когда оно нужно). Общий объем ограничен max_bytes, вытесняются
+    давно не использованные страницы.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS member_pages (
+            group_id INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            fields TEXT NOT NULL,
+            members_count INTEGER,
+            raw_count INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            fetched_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (group_id, offset, count, fields)
+        );
+        CREATE INDEX IF NOT EXISTS member_pages_accessed
+            ON member_pages (accessed_at);
+    """
+
+    # Во сколько раз срок жизни страницы можно продлить без загрузки
+    MAX_AGE_FACTOR = 4
+
+    def __init__(self, path, ttl_seconds, max_bytes):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_age = ttl_seconds * self.MAX_AGE_FACTOR
+        self.max_bytes = max_bytes
+        self.hits = 0    # за цикл, бот сбрасывает после отчета
+        self.misses = 0
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript(self.SCHEMA)
+            self.conn.execute(
+                "DELETE FROM member_pages WHERE fetched_at < ?", (time.time() - self.max_age,)
+            )
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM member_pages"
+        ).fetchone()[0]
+
+    @staticmethod
+    def _encode(records):
+        rows = [
+            [r.id, r.last_seen, int(r.online), r.birth, int(r.has_photo), int(r.profile_ok)]
+            for r in records
+        ]
+        return zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"))
+
+    @staticmethod
+    def _decode(data):
+        return [
+            MemberRecord(user_id, last_seen, bool(online), birth, bool(has_photo), bool(profile_ok))
+            for user_id, last_seen, online, birth, has_photo, profile_ok
+            in json.loads(zlib.decompress(data))
+        ]
+
+    @staticmethod
+    def _exclude(records, excluded_sets):
+        return [r for r in records if not any(r.id in id_set for id_set in excluded_sets)]
+
+    def get(self, group_id, offset, count, fields, members_count=None, excluded_sets=()):
+        """(список MemberRecord, сколько вернул API) или None
+
+        members_count - функция без аргументов, возвращающая текущее число
+        участников группы (или None, если оно неизвестно).
+        """
+        key = (group_id, offset, count, fields)
+        row = self.conn.execute(
+            "SELECT members_count, raw_count, data, fetched_at, expires_at FROM member_pages "
+            "WHERE group_id = ? AND offset = ? AND count = ? AND fields = ?", key
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        cached_count, raw_count, data, fetched_at, expires_at = row
+        now = time.time()
+        if expires_at <= now:
+            # Группа не изменилась - продлеваем страницу без загрузки
+            current_count = members_count() if members_count is not None else None
+            unchanged = current_count is not None and current_count == cached_count
+            if not unchanged or fetched_at + self.max_age <= now:
+                self._delete(key)
+                self.misses += 1
+                return None
+            expires_at = min(now + self.ttl_seconds, fetched_at + self.max_age)
+
+        with self.conn:
+            self.conn.execute(
+                "UPDATE member_pages SET expires_at = ?, accessed_at = ? "
+                "WHERE group_id = ? AND offset = ? AND count = ? AND fields = ?",
+                (expires_at, now) + key
+            )
+        self.hits += 1
+
+        return self._exclude(self._decode(data), excluded_sets), raw_count
+
+    def put(self, group_id, offset, count, fields, members_count, records, raw_count,
+            excluded_sets=()):
+        """Сохранение страницы, возвращает (records без исключенных, raw_count)"""
+        records = self._exclude(records, excluded_sets)
+        data = self._encode(records)
+        now = time.time()
+        key = (group_id, offset, count, fields)
+
+        self._delete(key)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO member_pages (group_id, offset, count, fields, members_count, "
+                "raw_count, data, size, fetched_at, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (members_count, raw_count, data, len(data), now, now + self.ttl_seconds, now)
+            )
+        self.total_bytes += len(data)
+        self._evict()
+        return records, raw_count
+
+    def _delete(self, key):
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT size FROM member_pages "
+                "WHERE group_id = ? AND offset = ? AND count = ? AND fields = ?", key
+            ).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "DELETE FROM member_pages "
+                    "WHERE group_id = ? AND offset = ? AND count = ? AND fields = ?", key
+                )
+                self.total_bytes -= row[0]
+
+    def _evict(self):
+        """Вытеснение давно не использованных страниц сверх max_bytes"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT rowid, size FROM member_pages ORDER BY accessed_at"
+            ).fetchall()
+            to_delete = []
+            for rowid, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                to_delete.append((rowid,))
+                self.total_bytes -= size
+            self.conn.executemany("DELETE FROM member_pages WHERE rowid = ?", to_delete)
+
+    def close(self):
+        self.conn.close()
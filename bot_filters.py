@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Фильтрация пользователей: правила, скомпилированные в числовые пороги"""
+
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:  # NumPy не обязателен
+    np = None
+
+# Порог, с которого пакет выгодно считать через NumPy
+NUMPY_MIN_BATCH = 256
+
+
+@lru_cache(maxsize=65536)
+def parse_bdate_ordinal(bdate):
+    """Дата рождения "Д.М.ГГГГ" -> порядковый номер дня или None
+
+    Разбор совпадает со strptime("%d.%m.%Y"): для нестандартной записи
+    вызывается strptime, неразборчивая дата дает None (возраст не проверяется).
+    """
+    parts = bdate.split(".")
+    if len(parts) != 3:
+        return None
+
+    day, month, year = parts
+    digits = day + month + year
+    if (0 < len(day) <= 2 and 0 < len(month) <= 2 and len(year) == 4
+            and digits.isdigit() and digits.isascii()):
+        try:
+            return date(int(year), int(month), int(day)).toordinal()
+        except ValueError:
+            return None
+
+    try:
+        return datetime.strptime(bdate, "%d.%m.%Y").toordinal()
+    except Exception:
+        return None
+
+
+def member_fields(filters):
+    """Поля groups.getMembers, нужные активным фильтрам
+
+    id, first_name, last_name и deactivated API отдает всегда.
+    """
+    fields = ["last_seen", "online"]
+    if filters.get("age_enabled", True):
+        fields.append("bdate")
+    if filters["has_photo"]:
+        fields.append("has_photo")
+    return ",".join(fields)
+
+
+class MemberRecord:
+    """Участник группы - только то, что нужно фильтрам и отправке заявок
+
+    last_seen - время последнего визита (None, если API его не вернул),
+    birth - дата рождения порядковым номером дня (None - неизвестна),
+    profile_ok - есть имя и фамилия, аккаунт не деактивирован.
+    """
+
+    __slots__ = ("id", "last_seen", "online", "birth", "has_photo", "profile_ok")
+
+    def __init__(self, id, last_seen=None, online=False, birth=None,
+                 has_photo=False, profile_ok=True):
+        self.id = id
+        self.last_seen = last_seen
+        self.online = online
+        self.birth = birth
+        self.has_photo = has_photo
+        self.profile_ok = profile_ok
+
+    @classmethod
+    def from_api(cls, user):
+        """Запись из элемента ответа groups.getMembers"""
+        get = user.get
+        last_seen = get("last_seen")
+        bdate = get("bdate")
+        # Позиционные аргументы: from_api вызывается на каждого участника
+        return cls(
+            user["id"],
+            last_seen["time"] if last_seen is not None else None,
+            bool(get("online", 0)),
+            parse_bdate_ordinal(bdate) if bdate is not None else None,
+            bool(get("has_photo", 0)),
+            bool(get("first_name")) and bool(get("last_name")) and not get("deactivated")
+        )
+
+    def __repr__(self):
+        return f"MemberRecord(id={self.id})"
+
+
+class CompiledFilter:
+    """Фильтр пользователей, скомпилированный на один цикл
+
+    Вместо datetime и strptime на каждого пользователя правила
+    превращаются в пороги: время последнего визита (epoch) и диапазон
+    дат рождения (порядковые номера дней). Результат совпадает
+    с построчной проверкой:
+      (now - last_seen).days > N  <=>  last_seen <= now - (N + 1) дней
+      (now - birth).days // 365 in [min, max]
+                                  <=>  birth in [today - 365*(max+1) + 1, today - 365*min]
+
+    Участник подходит, если:
+      - это не сам бот и его нет ни в одном из excluded_sets;
+      - last_seen > last_seen_cutoff, а без last_seen - он онлайн;
+      - дата рождения неизвестна или лежит в [birth_min, birth_max]
+        (если проверка возраста включена);
+      - есть фото (если нужно), profile_ok.
+    """
+
+    def __init__(self, filters, excluded_sets, own_id, now=None):
+        now = now or datetime.now()
+        today = now.date().toordinal()
+
+        self.excluded_sets = excluded_sets
+        self.own_id = own_id
+        self.need_photo = bool(filters["has_photo"])
+        self.check_age = bool(filters.get("age_enabled", True))
+        self.last_seen_cutoff = (now - timedelta(days=filters["last_seen_days"] + 1)).timestamp()
+        self.birth_min = today - 365 * (filters["age_max"] + 1) + 1
+        self.birth_max = today - 365 * filters["age_min"]
+
+    def filter_batch(self, members):
+        """Фильтрация пакета участников, возвращает список подходящих"""
+        if not isinstance(members, list):
+            members = list(members)
+        if np is not None and len(members) >= NUMPY_MIN_BATCH:
+            return self._filter_numpy(members)
+        return self._filter_python(members)
+
+    def _filter_python(self, members):
+        """Правила из описания класса одним циклом без вызовов методов
+
+        Дешевые проверки полей идут первыми, поиск по исключенным
+        множествам - только для прошедших их.
+        """
+        own_id = self.own_id
+        excluded_sets = self.excluded_sets
+        need_photo = self.need_photo
+        last_seen_cutoff = self.last_seen_cutoff
+        check_age = self.check_age
+        birth_min, birth_max = self.birth_min, self.birth_max
+
+        result = []
+        append = result.append
+        for member in members:
+            if not member.profile_ok or (need_photo and not member.has_photo):
+                continue
+            last_seen = member.last_seen
+            if last_seen is not None:
+                if last_seen <= last_seen_cutoff:
+                    continue
+            elif not member.online:
+                continue
+            if check_age:
+                birth = member.birth
+                if birth is not None and not birth_min <= birth <= birth_max:
+                    continue
+            user_id = member.id
+            if user_id == own_id:
+                continue
+            for id_set in excluded_sets:
+                if user_id in id_set:
+                    break
+            else:
+                append(member)
+        return result
+
+    def _filter_numpy(self, members):
+        """Правила из описания класса векторно, в столбцовом виде"""
+        n = len(members)
+        ids = np.fromiter((m.id for m in members), dtype=np.int64, count=n)
+        last_seen = np.fromiter(
+            (-1 if m.last_seen is None else m.last_seen for m in members),
+            dtype=np.float64, count=n
+        )
+        online = np.fromiter((m.online for m in members), dtype=bool, count=n)
+        mask = np.fromiter((m.profile_ok for m in members), dtype=bool, count=n)
+
+        mask &= ~self._excluded_mask(ids)
+        if self.need_photo:
+            mask &= np.fromiter((m.has_photo for m in members), dtype=bool, count=n)
+        mask &= np.where(last_seen >= 0, last_seen > self.last_seen_cutoff, online)
+        if self.check_age:
+            birth = np.fromiter(
+                (-1 if m.birth is None else m.birth for m in members),
+                dtype=np.int64, count=n
+            )
+            mask &= (birth < 0) | ((birth >= self.birth_min) & (birth <= self.birth_max))
+
+        return [members[i] for i in np.flatnonzero(mask)]
+
+    def _excluded_mask(self, ids):
+        """Исключенные ID: по отсортированному массиву IdSet - searchsorted"""
+        excluded = ids == self.own_id
+        for id_set in self.excluded_sets:
+            sorted_ids = getattr(id_set, "sorted_ids", None)
+            if sorted_ids is None:
+                excluded |= np.fromiter((i in id_set for i in ids.tolist()), dtype=bool, count=len(ids))
+                continue
+            base, extra = sorted_ids()
+            if len(base):
+                base = np.frombuffer(base, dtype=np.int64)
+                pos = np.searchsorted(base, ids).clip(max=len(base) - 1)
+                excluded |= base[pos] == ids
+            if extra:
+                excluded |= np.isin(ids, np.fromiter(extra, dtype=np.int64, count=len(extra)))
+        return excluded
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Логирование: запись в фоновом потоке, ротация, JSONL и прореживание
+
+Основной поток только кладет записи в очередь (QueueHandler), в файл
+и консоль их пишет QueueListener в отдельном потоке.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Поля, которые можно передать через extra={...} и которые попадают в JSONL
+STRUCTURED_FIELDS = ("user_id", "group_id", "phase", "duration")
+
+
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """Ротация по времени (when) и по размеру файла (max_bytes)
+
+    При нескольких ротациях по размеру за один интервал к имени архива
+    добавляется номер: vk_medical_bot.log.2024-01-01.1 и т.д.
+    backup_count ограничивает число архивов в обоих случаях.
+    """
+
+    def __init__(self, filename, max_bytes=0, when="midnight", backup_count=5):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding="utf-8")
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes:
+                return True
+        return False
+
+    def getFilesToDelete(self):
+        # Архивы удаляются от старых к новым по времени изменения: при
+        # сортировке по имени архив без номера и .10 оказались бы не на месте
+        dir_name, base_name = os.path.split(self.baseFilename)
+        prefix = base_name + "."
+        archives = [
+            os.path.join(dir_name, name) for name in os.listdir(dir_name)
+            if name.startswith(prefix)
+        ]
+        if len(archives) <= self.backupCount:
+            return []
+        archives.sort(key=lambda path: (os.stat(path).st_mtime_ns, path))
+        return archives[:len(archives) - self.backupCount]
+
+    def rotation_filename(self, default_name):
+        name = super().rotation_filename(default_name)
+        counter = 0
+        candidate = name
+        while os.path.exists(candidate):
+            counter += 1
+            candidate = f"{name}.{counter}"
+        return candidate
+
+
+class JsonFormatter(logging.Formatter):
+    """Строка JSON на запись: время, уровень, сообщение и структурные поля"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Запись из очереди: трассировка уже отформатирована в exc_text
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TracebackQueueHandler(QueueHandler):
+    """QueueHandler, который не вклеивает трассировку в сообщение
+
+    Стандартный prepare() форматирует запись целиком и обнуляет exc_info,
+    поэтому в JSONL трассировка попадала бы в message. Здесь текст
+    исключения остается в exc_text: текстовый формат допишет его после
+    сообщения, JSON - в поле exception.
+    """
+
+    _formatter = logging.Formatter()
+
+    def prepare(self, record):
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = self._formatter.formatException(record.exc_info)
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Прореживание частых строк
+
+    Записи с extra={"sample": "ключ"} пропускаются через одну из every
+    (первая всегда проходит); остальные записи не трогаются.
+    """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self.counters = {}
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None or self.every == 1:
+            return True
+        count = self.counters.get(key, 0)
+        self.counters[key] = count + 1
+        return count % self.every == 0
+
+
+def _stop_listener(listener):
+    """Дописать очередь при выходе (если слушатель еще не остановлен)"""
+    try:
+        listener.stop()
+    except AttributeError:
+        pass
+
+
+def setup_logging(log_file, json_format=False, max_bytes=10 * 1024 * 1024,
+                  backup_count=5, rotate_when="midnight", sample_every=1,
+                  level=logging.INFO):
+    """Настройка корневого логгера, возвращает запущенный QueueListener"""
+    file_handler = SizedTimedRotatingFileHandler(
+        log_file, max_bytes=max_bytes, when=rotate_when, backup_count=backup_count
+    )
+    file_handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(LOG_FORMAT))
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.Queue(-1)
+    queue_handler = TracebackQueueHandler(log_queue)
+    # Прореживаем до очереди, чтобы лишние записи не стоили ничего
+    queue_handler.addFilter(SamplingFilter(sample_every))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, file_handler, console_handler,
+                             respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
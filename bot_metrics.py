@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Метрики: запросы к API по методам и длительность фаз цикла
+
+Экспорт в текстовом формате Prometheus (файл и/или HTTP /metrics)
+и построчный JSONL с итогами каждого цикла.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("VK_Medical_Bot")
+
+# Границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class MethodStats:
+    """Счетчики одного метода API"""
+
+    __slots__ = ("calls", "batched", "errors", "seconds", "bytes", "buckets")
+
+    def __init__(self):
+        self.calls = 0       # HTTP запросов
+        self.batched = 0     # вызовов внутри execute
+        self.errors = {}     # код ошибки -> количество
+        self.seconds = 0.0
+        self.bytes = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "batched": self.batched,
+            "errors": dict(self.errors),
+            "seconds": round(self.seconds, 4),
+            "bytes": self.bytes,
+        }
+
+
+class Metrics:
+    """Сбор метрик бота
+
+    Итоги с момента запуска отдаются в формате Prometheus, счетчики
+    текущего цикла сбрасываются в JSONL методом flush_cycle().
+    """
+
+    def __init__(self, prometheus_file=None, jsonl_file=None):
+        self.prometheus_file = prometheus_file
+        self.jsonl_file = jsonl_file
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.cycles = 0
+
+        self.methods = {}        # method -> MethodStats с запуска
+        self.phase_totals = {}   # phase -> (количество, секунды)
+        self.phase_last = {}     # phase -> секунды в последнем цикле
+        self._cycle_methods = {}
+        self._cycle_phases = {}
+        self._server = None
+
+    def _stats(self, method):
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = MethodStats()
+        cycle_stats = self._cycle_methods.get(method)
+        if cycle_stats is None:
+            cycle_stats = self._cycle_methods[method] = MethodStats()
+        return stats, cycle_stats
+
+    # --- Сбор ---
+
+    def observe_call(self, method, seconds, error_code=None):
+        """HTTP запрос к методу API (error_code - код ошибки или вид ошибки)"""
+        with self.lock:
+            for stats in self._stats(method):
+                stats.observe(seconds)
+                if error_code is not None:
+                    stats.errors[str(error_code)] = stats.errors.get(str(error_code), 0) + 1
+
+    def observe_batched(self, method, error_code=None):
+        """Вызов метода внутри execute"""
+        with self.lock:
+            for stats in self._stats(method):
+                stats.batched += 1
+                if error_code is not None:
+                    stats.errors[str(error_code)] = stats.errors.get(str(error_code), 0) + 1
+
+    def add_bytes(self, method, size):
+        with self.lock:
+            for stats in self._stats(method):
+                stats.bytes += size
+
+    def attach_session(self, vk_session):
+        """Учет объема ответов через response hook сессии requests"""
+        def on_response(response, *args, **kwargs):
+            method = response.url.split("?", 1)[0].rsplit("/", 1)[-1]
+            self.add_bytes(method, len(response.content))
+        vk_session.http.hooks["response"].append(on_response)
+
+    @contextmanager
+    def span(self, phase):
+        """Замер длительности фазы цикла"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                count, total = self.phase_totals.get(phase, (0, 0.0))
+                self.phase_totals[phase] = (count + 1, total + elapsed)
+                self.phase_last[phase] = elapsed
+                self._cycle_phases[phase] = self._cycle_phases.get(phase, 0.0) + elapsed
+
+    # --- Экспорт ---
+
+    def render_prometheus(self):
+        """Метрики с момента запуска в текстовом формате Prometheus"""
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            methods = sorted(self.methods.items())
+
+            metric("vk_api_requests_total", "counter", "HTTP requests to VK API by method")
+            for method, stats in methods:
+                lines.append(f'vk_api_requests_total{{method="{method}"}} {stats.calls}')
+
+            metric("vk_api_batched_calls_total", "counter", "Calls made inside execute by method")
+            for method, stats in methods:
+                lines.append(f'vk_api_batched_calls_total{{method="{method}"}} {stats.batched}')
+
+            metric("vk_api_errors_total", "counter", "VK API errors by method and code")
+            for method, stats in methods:
+                for code, count in sorted(stats.errors.items()):
+                    lines.append(f'vk_api_errors_total{{method="{method}",code="{code}"}} {count}')
+
+            metric("vk_api_response_bytes_total", "counter", "Bytes received from VK API by method")
+            for method, stats in methods:
+                lines.append(f'vk_api_response_bytes_total{{method="{method}"}} {stats.bytes}')
+
+            metric("vk_api_request_duration_seconds", "histogram", "VK API request latency")
+            for method, stats in methods:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats.buckets):
+                    cumulative += count
+                    lines.append(
+                        f'vk_api_request_duration_seconds_bucket{{method="{method}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f'vk_api_request_duration_seconds_sum{{method="{method}"}} {stats.seconds:.6f}')
+                lines.append(f'vk_api_request_duration_seconds_count{{method="{method}"}} {stats.calls}')
+
+            metric("vk_bot_phase_seconds_total", "counter", "Total time spent in cycle phases")
+            for phase, (count, total) in sorted(self.phase_totals.items()):
+                lines.append(f'vk_bot_phase_seconds_total{{phase="{phase}"}} {total:.6f}')
+
+            metric("vk_bot_phase_runs_total", "counter", "Number of runs of cycle phases")
+            for phase, (count, total) in sorted(self.phase_totals.items()):
+                lines.append(f'vk_bot_phase_runs_total{{phase="{phase}"}} {count}')
+
+            metric("vk_bot_phase_last_seconds", "gauge", "Duration of the phase in the last cycle")
+            for phase, seconds in sorted(self.phase_last.items()):
+                lines.append(f'vk_bot_phase_last_seconds{{phase="{phase}"}} {seconds:.6f}')
+
+            metric("vk_bot_cycles_total", "counter", "Completed cycles")
+            lines.append(f"vk_bot_cycles_total {self.cycles}")
+            metric("vk_bot_start_time_seconds", "gauge", "Bot start time (unix)")
+            lines.append(f"vk_bot_start_time_seconds {self.started_at:.0f}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        """Атомарная запись файла метрик (для node_exporter textfile и т.п.)"""
+        if not self.prometheus_file:
+            return
+        temp_file = self.prometheus_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(temp_file, self.prometheus_file)
+
+    def flush_cycle(self, **extra):
+        """Итоги цикла в JSONL и файл Prometheus, сброс счетчиков цикла"""
+        with self.lock:
+            self.cycles += 1
+            record = {
+                "timestamp": datetime.now().isoformat(),
+                "cycle": self.cycles,
+                "phases": {k: round(v, 4) for k, v in self._cycle_phases.items()},
+                "api": {k: v.to_dict() for k, v in sorted(self._cycle_methods.items())},
+            }
+            record.update(extra)
+            self._cycle_methods = {}
+            self._cycle_phases = {}
+
+        try:
+            if self.jsonl_file:
+                with open(self.jsonl_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.write_prometheus()
+        except OSError as e:
+            logger.error(f"Ошибка записи метрик: {e}")
+        return record
+
+    def start_http_server(self, port, host="0.0.0.0"):
+        """Эндпоинт /metrics в фоновом потоке"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            # Эндпоинт необязателен: остаются файл Prometheus и JSONL
+            logger.error(f"Не удалось запустить HTTP /metrics на порту {port}: {e}")
+            return
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"📈 Метрики: http://{host}:{port}/metrics")
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Профилирование по запросу: cProfile для фаз цикла и tracemalloc для памяти
+
+Включается переменными окружения; когда выключено, бот не создает
+Profiler вообще и участки кода выполняются без оберток.
+"""
+
+import cProfile
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+
+logger = logging.getLogger("VK_Medical_Bot")
+
+
+class Profiler:
+    """Профилирование участков кода с сохранением дампов
+
+    cpu_targets - имена участков для cProfile ("cycle" - весь цикл,
+    "phases" - каждая фаза по отдельности или список конкретных фаз).
+    memory - снимки tracemalloc для участков, отмеченных memory=True.
+    Файлы: profile_<участок>_<время>.prof (открываются pstats/snakeviz)
+    и memory_<участок>_<время>.snapshot (tracemalloc.Snapshot.load).
+    """
+
+    PHASES = ("discovery", "check_new_friends", "invites", "friend_requests", "save_stats")
+
+    def __init__(self, cpu_targets, memory, output_dir):
+        targets = set(cpu_targets)
+        if "phases" in targets:
+            targets.discard("phases")
+            targets.update(self.PHASES)
+        self.cpu_targets = targets
+        self.memory = memory
+        self.output_dir = output_dir
+        self._cpu_active = None
+
+        os.makedirs(output_dir, exist_ok=True)
+        logger.info(
+            f"🔬 Профилирование: {', '.join(sorted(targets)) or 'нет'}"
+            f"{', память' if memory else ''} -> {output_dir}"
+        )
+
+    @classmethod
+    def from_config(cls, setting, memory, output_dir):
+        """Profiler по настройке PROFILE или None, если профилирование выключено"""
+        targets = [t.strip() for t in setting.lower().split(",") if t.strip()]
+        targets = [t for t in targets if t not in ("off", "false", "0")]
+        if not targets and not memory:
+            return None
+        return cls(targets, memory, output_dir)
+
+    def _path(self, kind, name, suffix):
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        return os.path.join(self.output_dir, f"{kind}_{name}_{stamp}.{suffix}")
+
+    @contextmanager
+    def section(self, name, memory=False):
+        """Профилирование участка name (если он выбран в настройках)"""
+        with ExitStack() as stack:
+            if name in self.cpu_targets:
+                stack.enter_context(self._cpu(name))
+            if memory and self.memory:
+                stack.enter_context(self._memory(name))
+            yield
+
+    @contextmanager
+    def _cpu(self, name):
+        # Профилировщик в потоке может быть только один: вложенный участок
+        # уже учтен во внешнем профиле
+        if self._cpu_active is not None:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        self._cpu_active = name
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._cpu_active = None
+            path = self._path("profile", name, "prof")
+            try:
+                profile.dump_stats(path)
+                logger.info(f"🔬 Профиль {name} ({time.perf_counter() - start:.2f} с): {path}")
+            except OSError as e:
+                logger.error(f"Ошибка сохранения профиля {name}: {e}")
+
+    @contextmanager
+    def _memory(self, name):
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(25)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_here:
+                tracemalloc.stop()
+            path = self._path("memory", name, "snapshot")
+            try:
+                snapshot.dump(path)
+                logger.info(
+                    f"🔬 Память {name}: сейчас {current / 1048576:.1f} МБ, "
+                    f"пик {peak / 1048576:.1f} МБ: {path}"
+                )
+            except OSError as e:
+                logger.error(f"Ошибка сохранения снимка памяти {name}: {e}")
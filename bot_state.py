@@ -0,0 +1,934 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Хранилища состояния бота (статистика, очереди, черные списки)"""
+
+import gzip
+import json
+import os
+import sys
+import mmap
+import heapq
+import sqlite3
+import logging
+from array import array
+from collections import deque
+from bisect import bisect_left
+from datetime import datetime
+
+logger = logging.getLogger("VK_Medical_Bot")
+
+# Ключи статистики, которые хранятся коллекциями, а не счетчиками
+COLLECTION_KEYS = (
+    "processed_users",
+    "blacklisted_users",
+    "friend_requests",
+    "friends_to_invite",
+    "open_groups",
+    "friends_snapshot",
+)
+
+
+class IdSet:
+    """Компактное множество ID пользователей
+
+    Основная часть - отсортированный array('q') (8 байт на ID вместо
+    ~60 у int в set), новые ID копятся в небольшом буфере и периодически
+    вливаются в массив. Файл формата IdSet отображается в память через
+    mmap без разбора и копирования.
+    """
+
+    MAGIC = b"VKIDSET1"
+    HEADER_SIZE = 16  # MAGIC + порядок байт + резерв
+    MIN_BUFFER = 1024
+
+    def __init__(self, ids=()):
+        self._sorted = array('q', sorted(set(ids)))
+        self._buffer = set()
+        self._mmap = None
+        self.dirty = False
+
+    @classmethod
+    def from_sorted(cls, ids):
+        """Создание из уже отсортированной последовательности без дублей"""
+        id_set = cls()
+        id_set._sorted = array('q', ids)
+        return id_set
+
+    def __contains__(self, user_id):
+        if user_id in self._buffer:
+            return True
+        ids = self._sorted
+        i = bisect_left(ids, user_id)
+        return i < len(ids) and ids[i] == user_id
+
+    def __len__(self):
+        return len(self._sorted) + len(self._buffer)
+
+    def __iter__(self):
+        return heapq.merge(self._sorted, sorted(self._buffer))
+
+    def sorted_ids(self):
+        """(отсортированный массив int64, буфер новых ID) - для векторных проверок"""
+        return self._sorted, self._buffer
+
+    def add(self, user_id):
+        if user_id in self:
+            return
+        self._buffer.add(user_id)
+        self.dirty = True
+        if len(self._buffer) >= max(self.MIN_BUFFER, len(self._sorted) >> 4):
+            self._merge()
+
+    def _merge(self):
+        """Вливание буфера в отсортированный массив"""
+        merged = array('q', heapq.merge(self._sorted, sorted(self._buffer)))
+        self._release_mmap(keep_data=False)
+        self._sorted = merged
+        self._buffer = set()
+
+    def _release_mmap(self, keep_data=True):
+        """Отвязка от отображенного файла (перед его заменой или переименованием)"""
+        if self._mmap is None:
+            return
+        view = self._sorted
+        if keep_data:
+            self._sorted = array('q')
+            self._sorted.frombytes(view.tobytes())
+        view.release()
+        self._mmap.close()
+        self._mmap = None
+
+    def save(self, path):
+        """Запись в бинарный файл: заголовок + отсортированные int64"""
+        if self._buffer or self._mmap is not None:
+            self._merge()
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            header = self.MAGIC + sys.byteorder[0].encode('ascii')
+            f.write(header.ljust(self.HEADER_SIZE, b"\0"))
+            self._sorted.tofile(f)
+        os.replace(tmp_path, path)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        """Загрузка файла через mmap (без разбора и копирования)"""
+        id_set = cls()
+        with open(path, 'rb') as f:
+            header = f.read(cls.HEADER_SIZE)
+            if not header.startswith(cls.MAGIC):
+                raise ValueError(f"{path}: неверный формат IdSet")
+            size = os.fstat(f.fileno()).st_size
+            if size == cls.HEADER_SIZE:
+                return id_set
+
+            if header[len(cls.MAGIC):len(cls.MAGIC) + 1] != sys.byteorder[0].encode('ascii'):
+                # Файл с другой платформы - читаем с разворотом байт
+                f.seek(cls.HEADER_SIZE)
+                ids = array('q')
+                ids.frombytes(f.read())
+                ids.byteswap()
+                id_set._sorted = ids
+                return id_set
+
+            id_set._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        id_set._sorted = memoryview(id_set._mmap)[cls.HEADER_SIZE:].cast('q')
+        return id_set
+
+
+class PendingRequests:
+    """Ожидающие заявки в друзья: индекс по user_id + куча по времени
+
+    Позволяет извлекать только заявки старше заданного момента
+    (pop_accepted, pop_expired), не просматривая весь список. Удаление ленивое: устаревшие записи
+    кучи пропускаются и периодически вычищаются.
+    """
+
+    def __init__(self, requests=()):
+        self._entries = {}  # user_id -> (epoch, timestamp)
+        self._heap = []
+        # Заявки, которые уже приняты (пользователь в друзьях)
+        self._accepted = set()
+        self._accepted_heap = []
+        for request in requests:
+            self.add(request)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __iter__(self):
+        for user_id, (_, timestamp) in self._entries.items():
+            yield {"user_id": user_id, "timestamp": timestamp}
+
+    def to_list(self):
+        return list(self)
+
+    def add(self, request):
+        user_id = request["user_id"]
+        timestamp = request["timestamp"]
+        epoch = datetime.fromisoformat(timestamp).timestamp()
+        self._entries[user_id] = (epoch, timestamp)
+        heapq.heappush(self._heap, (epoch, user_id))
+        self._maybe_compact()
+
+    def remove(self, user_id):
+        if self._entries.pop(user_id, None) is not None:
+            self._accepted.discard(user_id)
+            self._maybe_compact()
+
+    def mark_accepted(self, user_ids):
+        """Отметка заявок, принятых с прошлого цикла"""
+        for user_id in user_ids:
+            entry = self._entries.get(user_id)
+            if entry is not None and user_id not in self._accepted:
+                self._accepted.add(user_id)
+                heapq.heappush(self._accepted_heap, (entry[0], user_id))
+
+    def unmark_accepted(self, user_ids):
+        """Снятие отметки с тех, кто удалился из друзей"""
+        for user_id in user_ids:
+            self._accepted.discard(user_id)
+
+    def pop_accepted(self, cutoff_epoch):
+        """Извлечение принятых заявок, отправленных не позже cutoff_epoch"""
+        heap = self._accepted_heap
+        result = []
+        while heap and heap[0][0] <= cutoff_epoch:
+            epoch, user_id = heapq.heappop(heap)
+            entry = self._entries.get(user_id)
+            if user_id in self._accepted and entry is not None and entry[0] == epoch:
+                result.append(user_id)
+                self.remove(user_id)
+        return result
+
+    def pop_expired(self, cutoff_epoch, max_size=None):
+        """Извлечение непринятых заявок, отправленных не позже cutoff_epoch
+
+        Если заявок больше max_size, извлекаются и самые старые сверх
+        лимита. Принятые заявки остаются (ждут приглашения).
+        Возвращает [{"user_id", "timestamp"}] в порядке отправки.
+        """
+        heap = self._heap
+        entries = self._entries
+        result = []
+        kept = []
+        while heap:
+            epoch, user_id = heap[0]
+            over_limit = max_size is not None and len(entries) > max_size
+            if epoch > cutoff_epoch and not over_limit:
+                break
+            heapq.heappop(heap)
+            entry = entries.get(user_id)
+            if entry is None or entry[0] != epoch:
+                continue
+            if user_id in self._accepted:
+                kept.append((epoch, user_id))
+                if len(kept) >= len(entries):
+                    break  # остались только принятые
+                continue
+            del entries[user_id]
+            result.append({"user_id": user_id, "timestamp": entry[1]})
+        for item in kept:
+            heapq.heappush(heap, item)
+        return result
+
+    def _maybe_compact(self):
+        # Чистим кучу, когда устаревших записей больше, чем живых
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(epoch, user_id) for user_id, (epoch, _) in self._entries.items()]
+            heapq.heapify(self._heap)
+
+
+class InviteQueue:
+    """Очередь приглашений в группу
+
+    Добавление и извлечение за O(1) (или O(log n) в режиме приоритета),
+    без дублей по user_id. Вернуть пользователя в начало очереди
+    можно через requeue().
+
+    order="fifo" - в порядке добавления,
+    order="ready_since" - сначала те, кто дольше ждет приглашения.
+    """
+
+    ORDERS = ("fifo", "ready_since")
+
+    def __init__(self, items=(), order="fifo"):
+        if order not in self.ORDERS:
+            raise ValueError(f"Неизвестный порядок очереди приглашений: {order}")
+        self.order = order
+        self._items = {}      # user_id -> item
+        self._front = deque()  # возвращенные в начало очереди
+        self._queue = deque() if order == "fifo" else []
+        self._seq = 0
+        for item in items:
+            self.push(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, user_id):
+        return user_id in self._items
+
+    def __iter__(self):
+        """Элементы в порядке извлечения (для сохранения)"""
+        seen = set()
+        if self.order == "fifo":
+            ordered = self._queue
+        else:
+            ordered = (entry[-1] for entry in sorted(self._queue))
+        for user_id in list(self._front) + list(ordered):
+            if user_id in self._items and user_id not in seen:
+                seen.add(user_id)
+                yield self._items[user_id]
+
+    def push(self, item):
+        """Добавление в конец очереди, False если пользователь уже в ней"""
+        user_id = item["user_id"]
+        if user_id in self._items:
+            return False
+        self._items[user_id] = item
+        if self.order == "fifo":
+            self._queue.append(user_id)
+        else:
+            self._seq += 1
+            heapq.heappush(self._queue, (item["ready_since"], self._seq, user_id))
+        return True
+
+    def requeue(self, item):
+        """Возврат пользователя в начало очереди"""
+        self._items[item["user_id"]] = item
+        self._front.appendleft(item["user_id"])
+
+    def pop(self):
+        """Извлечение первого элемента (IndexError, если очередь пуста)"""
+        while self._front:
+            item = self._items.pop(self._front.popleft(), None)
+            if item is not None:
+                return item
+        while self._queue:
+            if self.order == "fifo":
+                user_id = self._queue.popleft()
+            else:
+                user_id = heapq.heappop(self._queue)[-1]
+            item = self._items.pop(user_id, None)
+            if item is not None:
+                return item
+        raise IndexError("pop from empty InviteQueue")
+
+
+class FriendsSnapshot:
+    """Версионированный снимок списка друзей
+
+    Между циклами хранится только множество ID и время, когда каждый
+    друг впервые появился в снимке (время принятия заявки).
+    """
+
+    def __init__(self, version=0, friends=None):
+        self.version = version
+        self.friends = dict(friends or {})  # user_id -> added_at
+
+    def __len__(self):
+        return len(self.friends)
+
+    def __contains__(self, user_id):
+        return user_id in self.friends
+
+    def apply(self, friend_ids, timestamp):
+        """Применение нового списка друзей, возвращает (added, removed)"""
+        friend_ids = set(friend_ids)
+        added = [user_id for user_id in friend_ids if user_id not in self.friends]
+        removed = [user_id for user_id in self.friends if user_id not in friend_ids]
+
+        for user_id in removed:
+            del self.friends[user_id]
+        for user_id in added:
+            self.friends[user_id] = timestamp
+
+        # Новая версия появляется только при изменениях
+        if added or removed:
+            self.version += 1
+        return added, removed
+
+    def to_dict(self):
+        return {
+            "version": self.version,
+            "friends": [[user_id, added_at] for user_id, added_at in self.friends.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(
+            data.get("version", 0),
+            {user_id: added_at for user_id, added_at in data.get("friends", [])}
+        )
+
+
+class RequestArchive:
+    """Архив истекших заявок: сжатый файл только для дозаписи
+
+    Каждая дозапись - отдельный член gzip со строками JSON (gzip.open
+    читает их подряд как один поток). Бот файл не перечитывает.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, entries, **extra):
+        if not entries:
+            return 0
+        lines = "".join(
+            json.dumps(dict(entry, **extra), ensure_ascii=False) + "\n" for entry in entries
+        )
+        with gzip.open(self.path, "ab") as f:
+            f.write(lines.encode("utf-8"))
+        return len(entries)
+
+    def __iter__(self):
+        if not os.path.exists(self.path):
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+class LazyStats(dict):
+    """Словарь статистики с отложенной загрузкой коллекций
+
+    Счетчики доступны сразу, коллекция загружается при первом обращении
+    по ключу (loaders: {ключ: функция без аргументов}). on_load() задает
+    преобразование, которое применяется к коллекции сразу после загрузки.
+    """
+
+    def __init__(self, data=(), loaders=None):
+        super().__init__(data)
+        self._loaders = dict(loaders or {})
+        self._transforms = {}
+
+    def __missing__(self, key):
+        loader = self._loaders.get(key)
+        if loader is None:
+            raise KeyError(key)
+        # Загрузчик снимается только после успешной загрузки: при ошибке
+        # (база занята, битый файл) следующее обращение попробует снова
+        try:
+            value = loader()
+            transform = self._transforms.get(key)
+            if transform is not None:
+                value = transform(value)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки {key}: {e}")
+            raise
+        del self._loaders[key]
+        self._transforms.pop(key, None)
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return super().__contains__(key) or key in self._loaders
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def is_loaded(self, key):
+        return super().__contains__(key)
+
+    def on_load(self, key, transform):
+        """Преобразование коллекции при загрузке (или сразу, если уже загружена)"""
+        if key in self._loaders:
+            self._transforms[key] = transform
+        elif self.is_loaded(key):
+            self[key] = transform(self[key])
+
+    def load_all(self):
+        for key in list(self._loaders):
+            self[key]
+        return self
+
+
+class StateBackend:
+    """Базовый интерфейс хранилища состояния
+
+    Бот держит рабочую копию в self.stats, а хранилищу сообщает
+    о каждом точечном изменении. Полная запись - только в save().
+    """
+
+    def exists(self):
+        """Есть ли уже сохраненное состояние"""
+        raise NotImplementedError
+
+    def load(self):
+        """Загрузка состояния в виде словаря статистики
+
+        Крупные коллекции можно отдавать лениво через LazyStats.
+        """
+        raise NotImplementedError
+
+    def save(self, stats):
+        """Сохранение счетчиков (и всего остального, если нужно)"""
+        raise NotImplementedError
+
+    def import_stats(self, stats):
+        """Полная запись состояния (используется при миграции)"""
+        raise NotImplementedError
+
+    # Точечные изменения. По умолчанию ничего не делают:
+    # хранилищу достаточно полной записи в save()
+    def add_processed_user(self, user_id):
+        pass
+
+    def add_blacklisted_user(self, user_id):
+        pass
+
+    def add_friend_request(self, request, counters=None):
+        """counters - счетчики {имя: значение}, изменившиеся вместе с заявкой"""
+        pass
+
+    def remove_friend_request(self, user_id):
+        pass
+
+    def remove_friend_requests(self, user_ids):
+        for user_id in user_ids:
+            self.remove_friend_request(user_id)
+
+    def add_invite(self, item, front=False):
+        pass
+
+    def remove_invite(self, user_id, counters=None):
+        pass
+
+    def add_open_group(self, group):
+        pass
+
+    def save_friends_delta(self, snapshot, added, removed):
+        pass
+
+    # Произвольные записи (кэши, индексы) по пространствам имен
+    def load_records(self, namespace):
+        """Все записи пространства имен в виде {key: value}"""
+        raise NotImplementedError
+
+    def put_record(self, namespace, key, value):
+        raise NotImplementedError
+
+    def delete_record(self, namespace, key):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonStateBackend(StateBackend):
+    """Хранение состояния в JSON файле
+
+    Множества ID лежат рядом в бинарных файлах IdSet
+    (medical_bot_stats.json.processed_users.ids и т.д.).
+    """
+
+    ID_SET_KEYS = ("processed_users", "blacklisted_users")
+
+    def __init__(self, path):
+        self.path = path
+        self._records = {}
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _id_set_path(self, key):
+        return f"{self.path}.{key}.ids"
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            stats_data = json.load(f)
+
+        self._records = stats_data.pop("records", {})
+        stats = stats_data.copy()
+        stats["friend_requests"] = PendingRequests(stats_data.get("friend_requests", []))
+        stats["friends_snapshot"] = FriendsSnapshot.from_dict(stats_data.get("friends_snapshot"))
+        loaders = {}
+        for key in self.ID_SET_KEYS:
+            id_set_path = self._id_set_path(key)
+            if os.path.exists(id_set_path):
+                # Бинарный файл открывается при первом обращении
+                stats.pop(key, None)
+                loaders[key] = lambda path=id_set_path: IdSet.load(path)
+            else:
+                # Старый формат: списки прямо в JSON
+                stats[key] = IdSet(stats_data.get(key, []))
+                stats[key].dirty = True
+        return LazyStats(stats, loaders)
+
+    def save(self, stats):
+        # Отсутствующие коллекции сохраняются пустыми
+        stats_to_save = stats.copy()
+        stats_to_save["friend_requests"] = list(stats.get("friend_requests", ()))
+        stats_to_save["friends_to_invite"] = list(stats.get("friends_to_invite", ()))
+        stats_to_save["records"] = self._records
+        snapshot = stats.get("friends_snapshot")
+        if snapshot is None:
+            snapshot = FriendsSnapshot()
+        stats_to_save["friends_snapshot"] = snapshot.to_dict()
+        for key in self.ID_SET_KEYS:
+            stats_to_save.pop(key, None)
+            if isinstance(stats, LazyStats) and not stats.is_loaded(key):
+                continue  # не загружался - файл на диске не менялся
+            id_set = stats.get(key)
+            if not isinstance(id_set, IdSet):
+                id_set = IdSet(id_set or ())
+            if id_set.dirty or not os.path.exists(self._id_set_path(key)):
+                id_set.save(self._id_set_path(key))
+
+        # Пишем во временный файл и подменяем атомарно, чтобы падение
+        # во время записи не портило состояние
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(stats_to_save, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def import_stats(self, stats):
+        self.save(stats)
+
+    def load_records(self, namespace):
+        return dict(self._records.get(namespace, {}))
+
+    def put_record(self, namespace, key, value):
+        # Записывается вместе со статистикой в save()
+        self._records.setdefault(namespace, {})[str(key)] = value
+
+    def delete_record(self, namespace, key):
+        self._records.get(namespace, {}).pop(str(key), None)
+
+
+class SqliteStateBackend(StateBackend):
+    """Хранение состояния в SQLite с точечными upsert'ами"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS processed_users (
+            user_id INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS blacklisted_users (
+            user_id INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS friend_requests (
+            user_id INTEGER PRIMARY KEY,
+            timestamp TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS friend_requests_timestamp
+            ON friend_requests (timestamp);
+        CREATE TABLE IF NOT EXISTS invite_queue (
+            user_id INTEGER PRIMARY KEY,
+            ready_since TEXT NOT NULL,
+            position INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS invite_queue_position
+            ON invite_queue (position);
+        CREATE TABLE IF NOT EXISTS open_groups (
+            id INTEGER NOT NULL UNIQUE,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS friends (
+            user_id INTEGER PRIMARY KEY,
+            added_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS friend_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            version INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS friend_events_user
+            ON friend_events (user_id);
+        CREATE TABLE IF NOT EXISTS records (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript(self.SCHEMA)
+
+    def exists(self):
+        row = self.conn.execute("SELECT COUNT(*) FROM counters").fetchone()
+        return row[0] > 0
+
+    def load(self):
+        # Сразу читаются только счетчики, коллекции - при первом обращении
+        stats = {}
+        for name, value in self.conn.execute("SELECT name, value FROM counters"):
+            stats[name] = json.loads(value)
+        return LazyStats(stats, {
+            "processed_users": lambda: self._load_id_set("processed_users"),
+            "blacklisted_users": lambda: self._load_id_set("blacklisted_users"),
+            "friend_requests": self._load_friend_requests,
+            "friends_to_invite": self._load_invite_queue,
+            "open_groups": self._load_open_groups,
+            "friends_snapshot": self._load_friends_snapshot,
+        })
+
+    def _load_id_set(self, table):
+        # Первичный ключ уже отсортирован - строим IdSet без сортировки
+        return IdSet.from_sorted(
+            row[0] for row in self.conn.execute(f"SELECT user_id FROM {table} ORDER BY user_id")
+        )
+
+    def _load_friend_requests(self):
+        return PendingRequests(
+            {"user_id": user_id, "timestamp": timestamp}
+            for user_id, timestamp in self.conn.execute(
+                "SELECT user_id, timestamp FROM friend_requests ORDER BY timestamp"
+            )
+        )
+
+    def _load_invite_queue(self):
+        return [
+            {"user_id": user_id, "ready_since": ready_since}
+            for user_id, ready_since in self.conn.execute(
+                "SELECT user_id, ready_since FROM invite_queue ORDER BY position"
+            )
+        ]
+
+    def _load_open_groups(self):
+        return [
+            json.loads(row[0])
+            for row in self.conn.execute("SELECT data FROM open_groups ORDER BY rowid")
+        ]
+
+    def _load_friends_snapshot(self):
+        version = self.conn.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM friend_events"
+        ).fetchone()[0]
+        return FriendsSnapshot(
+            version, self.conn.execute("SELECT user_id, added_at FROM friends")
+        )
+
+    def _counter_rows(self, stats):
+        return [
+            (name, json.dumps(value, ensure_ascii=False))
+            for name, value in stats.items()
+            if name not in COLLECTION_KEYS
+        ]
+
+    def save(self, stats):
+        # Коллекции уже записаны точечно, здесь только счетчики
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)",
+                self._counter_rows(stats)
+            )
+
+    def import_stats(self, stats):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)",
+                self._counter_rows(stats)
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO processed_users (user_id) VALUES (?)",
+                ((user_id,) for user_id in stats.get("processed_users", ()))
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO blacklisted_users (user_id) VALUES (?)",
+                ((user_id,) for user_id in stats.get("blacklisted_users", ()))
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO friend_requests (user_id, timestamp) VALUES (?, ?)",
+                ((r["user_id"], r["timestamp"]) for r in stats.get("friend_requests", ()))
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO invite_queue (user_id, ready_since, position) "
+                "VALUES (?, ?, ?)",
+                ((f["user_id"], f["ready_since"], position)
+                 for position, f in enumerate(stats.get("friends_to_invite", ())))
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO open_groups (id, data) VALUES (?, ?)",
+                ((g["id"], json.dumps(g, ensure_ascii=False))
+                 for g in stats.get("open_groups", ()))
+            )
+            snapshot = stats.get("friends_snapshot")
+            if snapshot is not None:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO friends (user_id, added_at) VALUES (?, ?)",
+                    snapshot.friends.items()
+                )
+                self.conn.executemany(
+                    "INSERT INTO friend_events (version, user_id, event, timestamp) "
+                    "VALUES (?, ?, 'added', ?)",
+                    ((snapshot.version, user_id, added_at)
+                     for user_id, added_at in snapshot.friends.items())
+                )
+
+    def add_processed_user(self, user_id):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO processed_users (user_id) VALUES (?)", (user_id,)
+            )
+
+    def add_blacklisted_user(self, user_id):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO blacklisted_users (user_id) VALUES (?)", (user_id,)
+            )
+
+    def _upsert_counters(self, counters):
+        # Вызывается внутри транзакции точечного изменения
+        if counters:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)",
+                self._counter_rows(counters)
+            )
+
+    def add_friend_request(self, request, counters=None):
+        # Заявка и дневные счетчики в одной транзакции: после падения
+        # посреди цикла лимиты не откатываются назад
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO friend_requests (user_id, timestamp) VALUES (?, ?)",
+                (request["user_id"], request["timestamp"])
+            )
+            self._upsert_counters(counters)
+
+    def remove_friend_request(self, user_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM friend_requests WHERE user_id = ?", (user_id,))
+
+    def remove_friend_requests(self, user_ids):
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM friend_requests WHERE user_id = ?",
+                ((user_id,) for user_id in user_ids)
+            )
+
+    def add_invite(self, item, front=False):
+        # Позиция в очереди: в конец - max + 1, в начало - min - 1
+        if front:
+            position_sql = "SELECT COALESCE(MIN(position), 0) - 1 FROM invite_queue"
+        else:
+            position_sql = "SELECT COALESCE(MAX(position), 0) + 1 FROM invite_queue"
+
+        with self.conn:
+            position = self.conn.execute(position_sql).fetchone()[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO invite_queue (user_id, ready_since, position) "
+                "VALUES (?, ?, ?)",
+                (item["user_id"], item["ready_since"], position)
+            )
+
+    def remove_invite(self, user_id, counters=None):
+        with self.conn:
+            self.conn.execute("DELETE FROM invite_queue WHERE user_id = ?", (user_id,))
+            self._upsert_counters(counters)
+
+    def add_open_group(self, group):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO open_groups (id, data) VALUES (?, ?)",
+                (group["id"], json.dumps(group, ensure_ascii=False))
+            )
+
+    def save_friends_delta(self, snapshot, added, removed):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO friends (user_id, added_at) VALUES (?, ?)",
+                ((user_id, snapshot.friends[user_id]) for user_id in added)
+            )
+            self.conn.executemany(
+                "DELETE FROM friends WHERE user_id = ?",
+                ((user_id,) for user_id in removed)
+            )
+            timestamp = datetime.now().isoformat()
+            self.conn.executemany(
+                "INSERT INTO friend_events (version, user_id, event, timestamp) "
+                "VALUES (?, ?, ?, ?)",
+                [(snapshot.version, user_id, "added", timestamp) for user_id in added] +
+                [(snapshot.version, user_id, "removed", timestamp) for user_id in removed]
+            )
+
+    def load_records(self, namespace):
+        return {
+            key: json.loads(value)
+            for key, value in self.conn.execute(
+                "SELECT key, value FROM records WHERE namespace = ?", (namespace,)
+            )
+        }
+
+    def put_record(self, namespace, key, value):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO records (namespace, key, value) VALUES (?, ?, ?)",
+                (namespace, str(key), json.dumps(value, ensure_ascii=False))
+            )
+
+    def delete_record(self, namespace, key):
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM records WHERE namespace = ? AND key = ?", (namespace, str(key))
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def migrate_json_state(json_path, backend):
+    """Одноразовый перенос состояния из JSON файла в новое хранилище
+
+    Старый файл переименовывается в *.migrated, чтобы миграция
+    не повторялась при следующем запуске. Поврежденный файл (например,
+    обрезанный при падении) переименовывается в *.corrupt, и бот
+    начинает с пустым хранилищем.
+    """
+    if not os.path.exists(json_path) or backend.exists():
+        return False
+
+    json_backend = JsonStateBackend(json_path)
+    try:
+        stats = json_backend.load()
+        backend.import_stats(stats)
+        for namespace, records in json_backend._records.items():
+            for key, value in records.items():
+                backend.put_record(namespace, key, value)
+    except Exception as e:
+        logger.error(f"Ошибка переноса состояния из {json_path}: {e}")
+        os.replace(json_path, json_path + ".corrupt")
+        logger.warning(f"Файл сохранен как {json_path}.corrupt, начинаем с пустой статистикой")
+        return False
+    os.replace(json_path, json_path + ".migrated")
+    for key in JsonStateBackend.ID_SET_KEYS:
+        id_set_path = json_backend._id_set_path(key)
+        if os.path.exists(id_set_path):
+            stats[key]._release_mmap()
+            os.replace(id_set_path, id_set_path + ".migrated")
+
+    logger.info(
+        f"📦 Состояние перенесено из {json_path}: "
+        f"{len(stats.get('processed_users', ()))} обработанных пользователей"
+    )
+    return True
+
+
+def create_state_backend(kind, json_path, sqlite_path):
+    """Создание хранилища по имени из конфигурации"""
+    if kind == "json":
+        return JsonStateBackend(json_path)
+    if kind == "sqlite":
+        backend = SqliteStateBackend(sqlite_path)
+        migrate_json_state(json_path, backend)
+        return backend
+    raise ValueError(f"Неизвестное хранилище состояния: {kind}")
@@ -4,24 +4,36 @@
 import vk_api
 import time
 import random
-import json
 import os
+import hashlib
 import logging
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import requests
 
+from bot_api import ApiBatcher, RateGovernor, classify_error
+from bot_metrics import Metrics
+from bot_profiling import Profiler
+from bot_logging import setup_logging
+from bot_filters import CompiledFilter, MemberRecord, member_fields
+from bot_cache import GroupCache, DiscoveryIndex, MemberPageCache, normalize_group_identifier
+from bot_state import (
+    IdSet, PendingRequests, InviteQueue, FriendsSnapshot, LazyStats, RequestArchive,
+    create_state_backend
+)
+
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("vk_medical_bot.log"),
-        logging.StreamHandler()
-    ]
+# Настройка логирования: запись в фоновом потоке, ротация по размеру и времени
+setup_logging(
+    os.getenv("LOG_FILE", "vk_medical_bot.log"),
+    json_format=os.getenv("LOG_FORMAT", "text").lower() == "json",
+    max_bytes=int(os.getenv("LOG_MAX_MB", 10)) * 1024 * 1024,
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", 5)),
+    rotate_when=os.getenv("LOG_ROTATE_WHEN", "midnight"),
+    sample_every=int(os.getenv("LOG_SAMPLE_EVERY", 10))
 )
 logger = logging.getLogger("VK_Medical_Bot")
 
@@ -30,13 +42,32 @@ class VKMedicalBot:
         """Инициализация бота с максимальными лимитами"""
         self.load_config()
         
+        # Метрики запросов к API и фаз цикла
+        self.metrics = None
+        if self.config["metrics_enabled"]:
+            self.metrics = Metrics(
+                prometheus_file=self.config["metrics_file"],
+                jsonl_file=self.config["metrics_jsonl"]
+            )
+            if self.config["metrics_port"]:
+                self.metrics.start_http_server(self.config["metrics_port"])
+        
         # Авторизация в ВК
         try:
             self.vk_session = vk_api.VkApi(token=self.config["access_token"])
-            self.vk = self.vk_session.get_api()
-            self.user_info = self.vk.users.get()[0]
-            self.user_id = self.user_info['id']
-            logger.info(f"Авторизация успешна: {self.user_info.get('first_name', '')} {self.user_info.get('last_name', '')}")
+            
+            # Все запросы к API идут через регулятор частоты
+            self.governor = RateGovernor(
+                self.vk_session,
+                requests_per_second=self.config["api_requests_per_second"],
+                flood_backoff=self.config["flood_backoff_minutes"] * 60,
+                captcha_halt=self.config["captcha_halt_hours"] * 3600,
+                metrics=self.metrics
+            )
+            if self.metrics is not None:
+                self.metrics.attach_session(self.vk_session)
+            self.vk = self.governor.get_api()
+            self.batcher = ApiBatcher(self.governor, enabled=self.config["api_batching"])
         except Exception as e:
             logger.error(f"Ошибка авторизации: {e}")
             exit(1)
@@ -60,7 +91,47 @@ class VKMedicalBot:
         ]
         
         self.stats_file = "medical_bot_stats.json"
+        self.stats_db_file = "medical_bot_stats.db"
+        self.member_cache_file = "medical_bot_pages.db"
+        self.request_archive_file = "medical_bot_requests_archive.jsonl.gz"
+        
+        # Профилирование (PROFILE / PROFILE_MEMORY), дампы рядом с файлом статистики
+        self.profiler = Profiler.from_config(
+            self.config["profile"],
+            self.config["profile_memory"],
+            self.config["profile_dir"] or os.path.dirname(os.path.abspath(self.stats_file))
+        )
+        
+        self.state = create_state_backend(
+            self.config["state_backend"], self.stats_file, self.stats_db_file
+        )
         self.load_stats()
+        self.authorize()
+        
+        # Архив заявок, оставшихся без ответа
+        self.request_archive = RequestArchive(self.request_archive_file)
+        
+        # Кэш метаданных групп (ID, название, доступность)
+        self.group_cache = GroupCache(
+            self.state,
+            ttl_seconds=self.config["group_cache_ttl_hours"] * 3600,
+            max_entries=self.config["group_cache_size"]
+        )
+        
+        # Дисковый кэш страниц участников (без уже обработанных пользователей)
+        self.page_cache = None
+        if self.config["member_cache_enabled"]:
+            self.page_cache = MemberPageCache(
+                self.member_cache_file,
+                ttl_seconds=self.config["member_cache_ttl_hours"] * 3600,
+                max_bytes=self.config["member_cache_max_mb"] * 1024 * 1024
+            )
+        
+        # Индекс проверенных при поиске групп (с отрицательным кэшем)
+        self.discovery_index = DiscoveryIndex(
+            self.state,
+            negative_ttl_seconds=self.config["discovery_negative_ttl_days"] * 86400
+        )
         
     def load_config(self):
         """Конфигурация с переменными окружения"""
@@ -81,8 +152,65 @@ class VKMedicalBot:
             # Время до приглашения
             "invite_after_friendship_hours": int(os.getenv("INVITE_AFTER_HOURS", 4)),
             
+            # Хранилище состояния: sqlite (по умолчанию) или json
+            "state_backend": os.getenv("STATE_BACKEND", "sqlite").lower(),
+            
+            # Заявки без ответа уходят в архив через FRIEND_REQUEST_EXPIRE_DAYS дней
+            # (0 - не истекают); в работе остается не больше MAX_PENDING_REQUESTS
+            "friend_request_expire_days": int(os.getenv("FRIEND_REQUEST_EXPIRE_DAYS", 30)),
+            "max_pending_requests": int(os.getenv("MAX_PENDING_REQUESTS", 3000)),
+            
+            # Порядок приглашений: fifo или ready_since (сначала ждущие дольше)
+            "invite_order": os.getenv("INVITE_ORDER", "fifo").lower(),
+            
+            # Кэш информации о группах
+            "group_cache_ttl_hours": int(os.getenv("GROUP_CACHE_TTL_HOURS", 24)),
+            "group_cache_size": int(os.getenv("GROUP_CACHE_SIZE", 500)),
+            
+            # Поиск групп: ключевых слов за проход и срок памяти об отказах
+            "discovery_keywords_per_run": int(os.getenv("DISCOVERY_KEYWORDS_PER_RUN", 5)),
+            "discovery_negative_ttl_days": int(os.getenv("DISCOVERY_NEGATIVE_TTL_DAYS", 7)),
+            
+            # Пакетные запросы к API через execute (до 25 вызовов за запрос)
+            "api_batching": os.getenv("API_BATCHING", "true").lower() == "true",
+            "member_pages_per_request": int(os.getenv("MEMBER_PAGES_PER_REQUEST", 3)),
+            
+            # Кэш страниц участников групп на диске
+            "member_cache_enabled": os.getenv("MEMBER_CACHE_ENABLED", "true").lower() == "true",
+            "member_cache_ttl_hours": int(os.getenv("MEMBER_CACHE_TTL_HOURS", 12)),
+            "member_cache_max_mb": int(os.getenv("MEMBER_CACHE_MAX_MB", 50)),
+            
+            # Регулятор запросов: лимит в секунду, пауза при флуд-контроле
+            # (удваивается при повторах) и остановка действия при капче
+            "api_requests_per_second": float(os.getenv("API_REQUESTS_PER_SECOND", 2.8)),
+            "flood_backoff_minutes": int(os.getenv("FLOOD_BACKOFF_MINUTES", 10)),
+            "captcha_halt_hours": int(os.getenv("CAPTCHA_HALT_HOURS", 6)),
+            
+            # Метрики: файл Prometheus, JSONL с итогами циклов, HTTP /metrics (0 - выключен)
+            "metrics_enabled": os.getenv("METRICS_ENABLED", "true").lower() == "true",
+            "metrics_file": os.getenv("METRICS_FILE", "medical_bot_metrics.prom"),
+            "metrics_jsonl": os.getenv("METRICS_JSONL", "medical_bot_metrics.jsonl"),
+            "metrics_port": int(os.getenv("METRICS_PORT", 0)),
+            
+            # Быстрый старт: ленивая загрузка состояния, данные аккаунта из кэша
+            # (IDENTITY_CACHE_HOURS), первичный поиск групп только в рабочие часы
+            "fast_start": os.getenv("FAST_START", "true").lower() == "true",
+            "identity_cache_hours": int(os.getenv("IDENTITY_CACHE_HOURS", 24)),
+            
+            # Профилирование: off, cycle, phases или список фаз через запятую;
+            # PROFILE_MEMORY - снимки tracemalloc для загрузки/сохранения и участников
+            "profile": os.getenv("PROFILE", "off"),
+            "profile_memory": os.getenv("PROFILE_MEMORY", "false").lower() == "true",
+            "profile_dir": os.getenv("PROFILE_DIR", ""),
+            
+            # Потоковая обработка участников: загрузка останавливается,
+            # когда подходящих кандидатов в stream_oversample раз больше, чем заявок
+            "streaming_pipeline": os.getenv("STREAMING_PIPELINE", "true").lower() == "true",
+            "stream_oversample": int(os.getenv("STREAM_OVERSAMPLE", 5)),
+            
             # Фильтры
             "filters": {
+                "age_enabled": os.getenv("FILTER_AGE_ENABLED", "true").lower() == "true",
                 "age_min": int(os.getenv("FILTER_AGE_MIN", 17)),
                 "age_max": int(os.getenv("FILTER_AGE_MAX", 32)),
                 "last_seen_days": int(os.getenv("FILTER_LAST_SEEN_DAYS", 10)),
@@ -95,22 +223,75 @@ class VKMedicalBot:
             logger.error("❌ Не заданы VK_ACCESS_TOKEN или YOUR_GROUP_ID")
             exit(1)
         
+    def authorize(self):
+        """Данные аккаунта: из кэша в хранилище состояния или через users.get"""
+        token_hash = hashlib.sha256(self.config["access_token"].encode("utf-8")).hexdigest()
+        cached = None
+        if self.config["fast_start"]:
+            cached = self.state.load_records("identity").get("account")
+        
+        if cached and cached["token_hash"] == token_hash and cached["expires_at"] > time.time():
+            self.user_info = cached["user_info"]
+            source = " (из кэша)"
+        else:
+            source = ""
+            try:
+                self.user_info = self.vk.users.get()[0]
+            except Exception as e:
+                logger.error(f"Ошибка авторизации: {e}")
+                exit(1)
+            self.state.put_record("identity", "account", {
+                "token_hash": token_hash,
+                "user_info": self.user_info,
+                "expires_at": time.time() + self.config["identity_cache_hours"] * 3600
+            })
+        
+        self.user_id = self.user_info['id']
+        logger.info(
+            f"Авторизация успешна: {self.user_info.get('first_name', '')} "
+            f"{self.user_info.get('last_name', '')}{source}"
+        )
+    
     def load_stats(self):
-        """Загрузка статистики"""
+        """Загрузка статистики (крупные коллекции - при первом обращении)"""
         try:
-            if os.path.exists(self.stats_file):
-                with open(self.stats_file, 'r', encoding='utf-8') as f:
-                    stats_data = json.load(f)
-                    # Конвертируем списки обратно в множества
-                    self.stats = stats_data.copy()
-                    self.stats["processed_users"] = set(stats_data.get("processed_users", []))
-                    self.stats["blacklisted_users"] = set(stats_data.get("blacklisted_users", []))
-            else:
-                self.stats = self.create_empty_stats()
-                self.save_stats()
+            with self.profile("load_stats", memory=True):
+                if self.state.exists():
+                    self.stats = self.state.load()
+                else:
+                    self.stats = self.create_empty_stats()
+                    self.save_stats()
+                self.prepare_stats()
+                if not self.config["fast_start"]:
+                    self.stats.load_all()
         except Exception as e:
             logger.error(f"Ошибка загрузки статистики: {e}")
             self.stats = self.create_empty_stats()
+            self.prepare_stats()
+    
+    def prepare_stats(self):
+        """Преобразования коллекций при загрузке"""
+        if not isinstance(self.stats, LazyStats):
+            self.stats = LazyStats(self.stats)
+        
+        # Очередь приглашений без дублей с O(1) добавлением и извлечением
+        self.stats.on_load("friends_to_invite", lambda items: InviteQueue(
+            items, order=self.config["invite_order"]
+        ))
+        
+        # Заявки, которые уже приняты по последнему снимку друзей
+        def mark_accepted(pending):
+            pending.mark_accepted(self.stats["friends_snapshot"].friends)
+            return pending
+        self.stats.on_load("friend_requests", mark_accepted)
+    
+    def counter_values(self, *names):
+        """Текущие значения счетчиков для записи вместе с точечным изменением
+
+        Дата сброса пишется всегда, иначе после перезапуска дневные
+        счетчики сбросились бы повторно.
+        """
+        return {name: self.stats[name] for name in ("last_reset_date",) + names}
     
     def create_empty_stats(self):
         """Создание пустой статистики"""
@@ -121,24 +302,20 @@ class VKMedicalBot:
             "invites_today": 0,
             "groups_found": 0,
             "last_reset_date": datetime.now().strftime("%Y-%m-%d"),
-            "processed_users": set(),
-            "friend_requests": [],
+            "processed_users": IdSet(),
+            "friend_requests": PendingRequests(),
             "friends_to_invite": [],
+            "friends_snapshot": FriendsSnapshot(),
             "open_groups": [],  # Список проверенных открытых групп
-            "blacklisted_users": set(),
+            "blacklisted_users": IdSet(),
             "successful_invites": 0
         }
     
     def save_stats(self):
         """Сохранение статистики"""
         try:
-            # Конвертируем set в list для JSON
-            stats_to_save = self.stats.copy()
-            stats_to_save["processed_users"] = list(self.stats["processed_users"])
-            stats_to_save["blacklisted_users"] = list(self.stats["blacklisted_users"])
-            
-            with open(self.stats_file, 'w', encoding='utf-8') as f:
-                json.dump(stats_to_save, f, indent=2, ensure_ascii=False)
+            with self.profile("save_stats", memory=True):
+                self.state.save(self.stats)
         except Exception as e:
             logger.error(f"Ошибка сохранения статистики: {e}")
     
@@ -152,11 +329,73 @@ class VKMedicalBot:
             self.stats["last_reset_date"] = today
             self.save_stats()
     
+    def get_group_info(self, group_identifier):
+        """Информация о группе (из кэша или через groups.getById)"""
+        cached = self.group_cache.get(group_identifier)
+        if cached is not None:
+            return cached
+        
+        key = normalize_group_identifier(group_identifier)
+        group_info = self.vk.groups.getById(group_id=key, fields="members_count")[0]
+        return self.group_cache.put(group_info, alias=key)
+    
+    def fetch_members_count(self, group_id):
+        """Текущее число участников группы через groups.getById (None при ошибке)"""
+        try:
+            return self.vk.groups.getById(group_id=group_id, fields="members_count")[0].get("members_count")
+        except Exception as e:
+            logger.warning(f"Не удалось получить число участников группы {group_id}: {e}", extra={"group_id": group_id})
+            return None
+    
+    def is_access_error(self, error):
+        """Ошибка означает отказ в доступе к группе (коды 15, 203)"""
+        return classify_error(error) == "access"
+    
+    def prefetch_groups(self, group_identifiers):
+        """Пакетная загрузка информации и проверка доступности групп"""
+        # Информация о группах, которых нет в кэше
+        unknown = [g for g in group_identifiers if self.group_cache.get(g) is None]
+        results = self.batcher.call_many([
+            ("groups.getById", {
+                "group_id": normalize_group_identifier(g),
+                "fields": "members_count"
+            })
+            for g in unknown
+        ])
+        for item in results:
+            if item.ok and item.result:
+                self.group_cache.put(item.result[0], alias=item.values["group_id"])
+        
+        # Пробные запросы участников для групп с неизвестной доступностью
+        to_probe = []
+        for g in group_identifiers:
+            cached = self.group_cache.get(g)
+            if cached is not None and cached["accessible"] is None:
+                to_probe.append(cached)
+        
+        results = self.batcher.call_many([
+            ("groups.getMembers", {"group_id": group["id"], "count": 1})
+            for group in to_probe
+        ])
+        for group, item in zip(to_probe, results):
+            if item.ok:
+                self.group_cache.put(group, accessible=True)
+            elif self.is_access_error(item.error):
+                self.group_cache.put(group, accessible=False)
+            else:
+                logger.error(f"Неизвестная ошибка проверки группы {group['id']}: {item.error}")
+        
+        return len(unknown) + len(to_probe)
+    
     def check_group_accessibility(self, group_id):
         """Проверка доступности группы для получения участников"""
+        cached = self.group_cache.get(group_id)
+        if cached is not None and cached["accessible"] is not None:
+            return cached["accessible"], (cached if cached["accessible"] else None)
+        
         try:
             # Пробуем получить информацию о группе
-            group_info = self.vk.groups.getById(group_ids=group_id, fields="members_count")[0]
+            group_info = cached or self.vk.groups.getById(group_ids=group_id, fields="members_count")[0]
             
             # Пробуем получить первых нескольких участников
             test_response = self.vk.groups.getMembers(
@@ -164,10 +403,12 @@ class VKMedicalBot:
                 count=1
             )
             
-            return True, group_info
+            return True, self.group_cache.put(group_info, accessible=True)
         except Exception as e:
-            error_str = str(e).lower()
-            if "access" in error_str or "denied" in error_str or "203" in error_str:
+            if self.is_access_error(e):
+                # Закрытую группу тоже запоминаем, чтобы не проверять снова
+                if isinstance(group_id, int):
+                    self.group_cache.put({"id": group_id}, accessible=False)
                 return False, None
             else:
                 logger.error(f"Неизвестная ошибка проверки группы {group_id}: {e}")
@@ -178,42 +419,66 @@ class VKMedicalBot:
         logger.info("🔍 Поиск открытых медицинских групп")
         
         new_open_groups = []
+        existing_ids = {g["id"] for g in self.stats["open_groups"]}
         
-        for keyword in self.medical_keywords[:5]:  # Ограничиваем количество поисков
+        # Ключевые слова ротируются между запусками
+        keywords = self.discovery_index.next_keywords(
+            self.medical_keywords, self.config["discovery_keywords_per_run"]
+        )
+        
+        for keyword in keywords:
             try:
-                time.sleep(3)  # Задержка между поисками
-                
                 response = self.vk.groups.search(
                     q=keyword,
                     count=50,  # Увеличиваем количество для поиска
                     fields="members_count,activity,is_closed"
                 )
                 
+                candidates = []
                 for group in response["items"]:
+                    group_id = group["id"]
+                    
+                    # Уже добавленные и недавно отклоненные группы не проверяем
+                    if group_id in existing_ids or self.discovery_index.is_known(group_id):
+                        continue
+                    
                     # Фильтруем только открытые группы среднего размера
-                    if (group.get("members_count", 0) > 500 and 
-                        group.get("members_count", 0) < 100000 and
-                        group.get("is_closed", 1) == 0):  # 0 = открытая группа
-                        
-                        # Проверяем доступность
-                        is_accessible, group_info = self.check_group_accessibility(group["id"])
-                        
-                        if is_accessible:
-                            group_data = {
-                                "id": group["id"],
-                                "name": group["name"],
-                                "screen_name": group.get("screen_name", ""),
-                                "members_count": group.get("members_count", 0),
-                                "verified_date": datetime.now().isoformat()
-                            }
-                            
-                            # Проверяем, что группы еще нет в списке
-                            existing_ids = [g["id"] for g in self.stats["open_groups"]]
-                            if group["id"] not in existing_ids:
-                                new_open_groups.append(group_data)
-                                logger.info(f"✅ Найдена открытая группа: {group['name']} ({group.get('members_count', 0)} участников)")
+                    if group.get("is_closed", 1) != 0:  # 0 = открытая группа
+                        self.discovery_index.reject(group_id, "closed")
+                        continue
+                    if not 500 < group.get("members_count", 0) < 100000:
+                        self.discovery_index.reject(group_id, "size")
+                        continue
+                    
+                    # Информация о группе уже есть в ответе поиска
+                    if self.group_cache.get(group_id) is None:
+                        self.group_cache.put(group)
+                    candidates.append(group)
+                
+                # Проверяем доступность всех кандидатов одним пакетом
+                self.prefetch_groups([group["id"] for group in candidates])
+                
+                for group in candidates:
+                    group_id = group["id"]
+                    is_accessible, group_info = self.check_group_accessibility(group_id)
+                    
+                    if is_accessible:
+                        group_data = {
+                            "id": group_id,
+                            "name": group["name"],
+                            "screen_name": group.get("screen_name", ""),
+                            "members_count": group.get("members_count", 0),
+                            "verified_date": datetime.now().isoformat()
+                        }
                         
-                        time.sleep(2)  # Задержка между проверками
+                        new_open_groups.append(group_data)
+                        existing_ids.add(group_id)
+                        self.state.add_open_group(group_data)
+                        self.discovery_index.verify(group_id)
+                        logger.info(f"✅ Найдена открытая группа: {group['name']} ({group.get('members_count', 0)} участников)")
+                    elif (self.group_cache.get(group_id) or {}).get("accessible") is False:
+                        # Временные ошибки не запоминаем, только явный отказ в доступе
+                        self.discovery_index.reject(group_id, "denied")
                         
             except Exception as e:
                 logger.error(f"Ошибка поиска групп по ключевому слову '{keyword}': {e}")
@@ -240,124 +505,133 @@ class VKMedicalBot:
         
         return all_groups
     
-    def get_group_members_safe(self, group_identifier, max_count=1000):
-        """Безопасное получение участников группы"""
+    def iter_group_member_pages(self, group_identifier, max_count=1000):
+        """Постраничная загрузка участников группы (генератор)
+        
+        Страницы отдаются по мере получения парами (список MemberRecord, сколько
+        участников вернул API); следующий запрос к API делается, только когда
+        вызывающий код попросит следующую страницу. Из кэша страницы приходят
+        без уже обработанных пользователей, поэтому объем просмотренного
+        считается по второму значению.
+        """
         try:
-            # Получаем ID группы
-            if isinstance(group_identifier, str) and not str(group_identifier).isdigit():
-                try:
-                    group_info = self.vk.groups.getById(group_id=group_identifier)[0]
-                    group_id = group_info["id"]
-                    group_name = group_info["name"]
-                except:
-                    logger.warning(f"❌ Группа {group_identifier} не найдена")
-                    return []
-            else:
-                group_id = int(group_identifier)
-                
-                # Получаем информацию о группе
-                try:
-                    group_info = self.vk.groups.getById(group_ids=group_id)[0]
-                    group_name = group_info["name"]
-                except:
-                    group_name = f"ID{group_id}"
+            # Получаем ID и название группы (через кэш)
+            try:
+                group_info = self.get_group_info(group_identifier)
+                group_id = group_info["id"]
+                group_name = group_info["name"]
+            except Exception:
+                logger.warning(f"❌ Группа {group_identifier} не найдена")
+                return
             
-            logger.info(f"📥 Получение участников группы: {group_name}")
+            logger.info(f"📥 Получение участников группы: {group_name}", extra={"group_id": group_id})
             
             # Проверяем доступность
             is_accessible, _ = self.check_group_accessibility(group_id)
             if not is_accessible:
-                logger.warning(f"❌ Нет доступа к группе {group_name}")
-                return []
+                logger.warning(f"❌ Нет доступа к группе {group_name}", extra={"group_id": group_id})
+                return
             
-            members = []
-            offset = 0
+            loaded = 0
             batch_size = 1000
             
-            while offset < max_count:
-                time.sleep(2)  # Увеличиваем задержку
+            # Страницы, которые нужно загрузить (если размер группы известен)
+            total = min(max_count, group_info.get("members_count") or max_count)
+            offsets = list(range(0, total, batch_size))
+            pages_per_request = max(1, self.config["member_pages_per_request"])
+            
+            # Запрашиваем только поля, которые нужны активным фильтрам
+            fields = member_fields(self.config["filters"])
+            # В кэше групп число участников может быть старше страниц:
+            # для продления истекших страниц берем свежее (один запрос на группу)
+            fresh_count = []
+            def current_members_count():
+                if not fresh_count:
+                    fresh_count.append(self.fetch_members_count(group_id))
+                return fresh_count[0]
+            # Обработанные пользователи в кэш не попадают
+            excluded_sets = (self.stats["processed_users"], self.stats["blacklisted_users"])
+            
+            # Несколько страниц уходят одним пакетным запросом
+            for i in range(0, len(offsets), pages_per_request):
+                chunk = [(offset, min(batch_size, max_count - offset))
+                         for offset in offsets[i:i + pages_per_request]]
                 
-                try:
-                    response = self.vk.groups.getMembers(
-                        group_id=group_id,
-                        offset=offset,
-                        count=min(batch_size, max_count - offset),
-                        fields="sex,bdate,city,last_seen,has_photo,connections,online"
-                    )
+                # Сначала страницы из кэша, запрашиваем только недостающие
+                pages = {}
+                if self.page_cache is not None:
+                    for offset, count in chunk:
+                        page = self.page_cache.get(
+                            group_id, offset, count, fields, current_members_count, excluded_sets
+                        )
+                        if page is not None:
+                            pages[offset] = page
+                
+                missing = [(offset, count) for offset, count in chunk if offset not in pages]
+                results = self.batcher.call_many([
+                    ("groups.getMembers", {
+                        "group_id": group_id,
+                        "offset": offset,
+                        "count": count,
+                        "fields": fields
+                    })
+                    for offset, count in missing
+                ])
+                
+                for (offset, count), item in zip(missing, results):
+                    if not item.ok:
+                        pages[offset] = item.error
+                        continue
                     
-                    batch = response["items"]
-                    if not batch:
-                        break
+                    batch = item.result["items"]
+                    records = [MemberRecord.from_api(user) for user in batch]
+                    if self.page_cache is not None:
+                        pages[offset] = self.page_cache.put(
+                            group_id, offset, count, fields, item.result.get("count"),
+                            records, len(batch), excluded_sets
+                        )
+                    else:
+                        pages[offset] = (records, len(batch))
+                
+                for offset, count in chunk:
+                    page = pages[offset]
+                    if isinstance(page, Exception):
+                        logger.error(f"Ошибка получения участников: {page}")
+                        return
                     
-                    members.extend(batch)
-                    offset += len(batch)
+                    records, raw_count = page
+                    loaded += raw_count
+                    # Строк прогресса много - в лог попадает каждая LOG_SAMPLE_EVERY-я
+                    logger.info(
+                        f"📊 Загружено {loaded} участников из {group_name}",
+                        extra={"group_id": group_id, "sample": "members_progress"}
+                    )
                     
-                    logger.info(f"📊 Загружено {len(members)} участников из {group_name}")
+                    yield records, raw_count
                     
-                    if len(batch) < batch_size:
-                        break
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка получения участников: {e}")
-                    break
-            
-            # Перемешиваем для естественности
-            random.shuffle(members)
-            logger.info(f"✅ Получено {len(members)} участников из {group_name}")
-            
-            return members
+                    if raw_count < count:
+                        return
             
         except Exception as e:
             logger.error(f"Критическая ошибка получения участников: {e}")
-            return []
+    
+    def compile_user_filter(self):
+        """Фильтры из конфигурации в виде числовых порогов (один раз на цикл)"""
+        return CompiledFilter(
+            self.config["filters"],
+            excluded_sets=(self.stats["processed_users"], self.stats["blacklisted_users"]),
+            own_id=self.user_id
+        )
+    
+    def filter_users_batch(self, users, user_filter=None):
+        """Фильтрация пакета пользователей скомпилированным фильтром"""
+        if user_filter is None:
+            user_filter = self.compile_user_filter()
+        return user_filter.filter_batch(users)
     
     def filter_users_advanced(self, users):
         """Продвинутая фильтрация пользователей"""
-        filtered = []
-        filters = self.config["filters"]
-        
-        for user in users:
-            user_id = user["id"]
-            
-            # Базовые проверки
-            if (user_id in self.stats["processed_users"] or
-                user_id in self.stats["blacklisted_users"] or
-                user_id == self.user_id):
-                continue
-            
-            # Проверка активности
-            if "last_seen" in user:
-                last_seen = datetime.fromtimestamp(user["last_seen"]["time"])
-                days_inactive = (datetime.now() - last_seen).days
-                if days_inactive > filters["last_seen_days"]:
-                    continue
-            elif not user.get("online", 0):
-                # Если нет данных о последнем визите и пользователь не онлайн
-                continue
-            
-            # Проверка возраста (если есть дата рождения)
-            if "bdate" in user and len(user["bdate"].split(".")) == 3:
-                try:
-                    birth_date = datetime.strptime(user["bdate"], "%d.%m.%Y")
-                    age = (datetime.now() - birth_date).days // 365
-                    if age < filters["age_min"] or age > filters["age_max"]:
-                        continue
-                except:
-                    pass
-            
-            # Проверка наличия фото
-            if filters["has_photo"] and not user.get("has_photo", 0):
-                continue
-            
-            # Проверка на ботов (если есть подозрительные признаки)
-            if not user.get("first_name") or not user.get("last_name"):
-                continue
-                
-            # Проверка на деактивированные аккаунты
-            if user.get("deactivated"):
-                continue
-            
-            filtered.append(user)
+        filtered = self.filter_users_batch(users)
         
         logger.info(f"🎯 Отфильтровано {len(filtered)} качественных пользователей")
         return filtered
@@ -371,76 +645,120 @@ class VKMedicalBot:
             self.stats["friend_requests_sent"] += 1
             self.stats["friend_requests_today"] += 1
             self.stats["processed_users"].add(user_id)
-            self.stats["friend_requests"].append({
+            self.state.add_processed_user(user_id)
+            request = {
                 "user_id": user_id,
                 "timestamp": datetime.now().isoformat()
-            })
+            }
+            self.stats["friend_requests"].add(request)
+            self.state.add_friend_request(request, self.counter_values(
+                "friend_requests_sent", "friend_requests_today"
+            ))
+            if user_id in self.stats["friends_snapshot"]:
+                self.stats["friend_requests"].mark_accepted([user_id])
             
-            logger.info(f"✅ Заявка отправлена: ID{user_id}")
+            logger.info(f"✅ Заявка отправлена: ID{user_id}", extra={"user_id": user_id})
             return True
             
         except Exception as e:
-            error_msg = str(e).lower()
+            error_kind = classify_error(e)
             
-            if "captcha" in error_msg:
-                logger.warning("🤖 Капча! Пауза 15 минут")
-                time.sleep(900)  # 15 минут
+            if error_kind in ("captcha", "flood", "rate_limit", "throttled", "too_many_requests"):
+                # Паузу назначил регулятор, пользователя попробуем позже
+                logger.warning(f"⏸️ Заявка ID{user_id} не отправлена: {e}", extra={"user_id": user_id})
                 return False
-            elif "blacklist" in error_msg or "denied" in error_msg:
+            elif error_kind in ("blacklist", "access"):
                 self.stats["blacklisted_users"].add(user_id)
-                logger.info(f"❌ Пользователь ID{user_id} в черном списке")
-            elif "flood" in error_msg or "many requests" in error_msg:
-                logger.warning("🌊 Флуд-контроль! Пауза 10 минут")
-                time.sleep(600)  # 10 минут
-                return False
-            elif "already" in error_msg:
-                logger.info(f"ℹ️ ID{user_id} уже в друзьях или заявка отправлена")
+                self.state.add_blacklisted_user(user_id)
+                logger.info(f"❌ Пользователь ID{user_id} в черном списке", extra={"user_id": user_id})
+            elif "already" in str(e).lower():
+                logger.info(f"ℹ️ ID{user_id} уже в друзьях или заявка отправлена", extra={"user_id": user_id})
             else:
-                logger.error(f"Ошибка заявки ID{user_id}: {e}")
+                logger.error(f"Ошибка заявки ID{user_id}: {e}", extra={"user_id": user_id})
             
             self.stats["processed_users"].add(user_id)
+            self.state.add_processed_user(user_id)
             return False
     
+    def get_all_friends(self):
+        """Получение полного списка друзей (с постраничной загрузкой)"""
+        friend_ids = []
+        offset = 0
+        batch_size = 5000
+        
+        while True:
+            response = self.vk.friends.get(offset=offset, count=batch_size)
+            batch = response["items"]
+            friend_ids.extend(batch)
+            offset += len(batch)
+            
+            if not batch or offset >= response.get("count", 0):
+                break
+        
+        return friend_ids
+    
     def check_new_friends(self):
         """Проверка новых друзей для приглашения"""
         try:
-            # Получаем текущих друзей
-            friends = self.vk.friends.get()["items"]
-            
-            # Проверяем заявки
+            # Сравниваем текущих друзей с прошлым снимком
+            snapshot = self.stats["friends_snapshot"]
             current_time = datetime.now()
-            ready_to_invite = []
+            added, removed = snapshot.apply(self.get_all_friends(), current_time.isoformat())
             
-            for request in self.stats["friend_requests"][:]:
-                user_id = request["user_id"]
-                request_time = datetime.fromisoformat(request["timestamp"])
-                
-                # Если пользователь теперь друг
-                if user_id in friends:
-                    # Проверяем, прошло ли достаточно времени
-                    hours_passed = (current_time - request_time).total_seconds() / 3600
-                    
-                    if hours_passed >= self.config["invite_after_friendship_hours"]:
-                        ready_to_invite.append(user_id)
-                        # Удаляем из списка заявок
-                        self.stats["friend_requests"].remove(request)
+            if added or removed:
+                self.state.save_friends_delta(snapshot, added, removed)
+                logger.info(f"👥 Друзья: +{len(added)} / -{len(removed)} (версия {snapshot.version})")
+            
+            # В сверку идет только дельта
+            pending = self.stats["friend_requests"]
+            pending.mark_accepted(added)
+            pending.unmark_accepted(removed)
+            
+            # Готовы к приглашению принятые заявки, с которых прошло достаточно времени
+            cutoff = current_time - timedelta(hours=self.config["invite_after_friendship_hours"])
+            ready_to_invite = pending.pop_accepted(cutoff.timestamp())
             
-            # Добавляем в список для приглашения
             for user_id in ready_to_invite:
-                # Проверяем, что его еще нет в списке
-                existing_users = [f["user_id"] for f in self.stats["friends_to_invite"]]
-                if user_id not in existing_users:
-                    self.stats["friends_to_invite"].append({
-                        "user_id": user_id,
-                        "ready_since": current_time.isoformat()
-                    })
+                # Удаляем из списка заявок
+                self.state.remove_friend_request(user_id)
+                
+                # Добавляем в список для приглашения, если его там еще нет
+                item = {
+                    "user_id": user_id,
+                    "ready_since": current_time.isoformat()
+                }
+                if self.stats["friends_to_invite"].push(item):
+                    self.state.add_invite(item)
             
             if ready_to_invite:
                 logger.info(f"👥 {len(ready_to_invite)} новых друзей готовы к приглашению")
             
+            self.expire_friend_requests(current_time)
+            
         except Exception as e:
             logger.error(f"Ошибка проверки друзей: {e}")
     
+    def expire_friend_requests(self, current_time):
+        """Перенос старых заявок без ответа в архив"""
+        expire_days = self.config["friend_request_expire_days"]
+        max_pending = self.config["max_pending_requests"] or None
+        if expire_days <= 0 and max_pending is None:
+            return
+        
+        cutoff = float("-inf")
+        if expire_days > 0:
+            cutoff = (current_time - timedelta(days=expire_days)).timestamp()
+        
+        pending = self.stats["friend_requests"]
+        expired = pending.pop_expired(cutoff, max_pending)
+        if not expired:
+            return
+        
+        # Сначала архив, потом удаление: при сбое заявка не потеряется
+        self.request_archive.append(expired, expired_at=current_time.isoformat())
+        self.state.remove_friend_requests([request["user_id"] for request in expired])
+        logger.info(f"🗄️ В архив: {len(expired)} заявок без ответа, ожидает ответа {len(pending)}")
+    
     def invite_friends_to_group_safe(self):
         """Безопасное приглашение друзей в группу"""
         if not self.stats["friends_to_invite"]:
@@ -456,13 +774,17 @@ class VKMedicalBot:
         if max_invites <= 0:
             return
         
+        if not self.governor.available("groups.invite"):
+            logger.warning("⏸️ Приглашения приостановлены регулятором")
+            return
+        
         logger.info(f"📨 Отправка {max_invites} приглашений в группу")
         
         success_count = 0
         group_id = self.config["your_group_id"]
         
         for i in range(max_invites):
-            friend = self.stats["friends_to_invite"].pop(0)
+            friend = self.stats["friends_to_invite"].pop()
             user_id = friend["user_id"]
             
             try:
@@ -471,25 +793,131 @@ class VKMedicalBot:
                 self.stats["invites_sent"] += 1
                 self.stats["invites_today"] += 1
                 self.stats["successful_invites"] += 1
+                # Удаление из очереди и счетчики - одной транзакцией
+                self.state.remove_invite(user_id, self.counter_values(
+                    "invites_sent", "invites_today", "successful_invites"
+                ))
                 success_count += 1
                 
-                logger.info(f"✅ Приглашение отправлено: ID{user_id}")
+                logger.info(f"✅ Приглашение отправлено: ID{user_id}", extra={"user_id": user_id, "group_id": group_id})
                 
                 # Увеличенная задержка между приглашениями
                 time.sleep(random.randint(30, 60))
                 
             except Exception as e:
-                error_msg = str(e).lower()
-                if "flood" in error_msg:
-                    logger.warning("🌊 Лимит приглашений! Остановка")
+                if classify_error(e) in ("captcha", "flood", "rate_limit", "throttled", "too_many_requests"):
+                    logger.warning(f"🌊 Лимит приглашений! Остановка: {e}")
                     # Возвращаем пользователя в список
-                    self.stats["friends_to_invite"].insert(0, friend)
+                    self.stats["friends_to_invite"].requeue(friend)
+                    self.state.add_invite(friend, front=True)
                     break
                 else:
-                    logger.error(f"Ошибка приглашения ID{user_id}: {e}")
+                    self.state.remove_invite(user_id)
+                    logger.error(f"Ошибка приглашения ID{user_id}: {e}", extra={"user_id": user_id, "group_id": group_id})
         
         logger.info(f"📊 Успешно отправлено приглашений: {success_count}")
     
+    def collect_candidates(self, all_groups, max_groups_per_cycle):
+        """Сбор всех участников из нескольких групп и их фильтрация"""
+        all_users = []
+        groups_processed = 0
+        
+        for group in all_groups:
+            if groups_processed >= max_groups_per_cycle:
+                break
+                
+            # Группа засчитывается по числу участников, которые вернул API:
+            # из кэша страницы приходят уже без обработанных пользователей
+            users = []
+            loaded = 0
+            for records, raw_count in self.iter_group_member_pages(group, max_count=500):
+                users.extend(records)
+                loaded += raw_count
+            
+            if loaded:
+                random.shuffle(users)
+                all_users.extend(users)
+                groups_processed += 1
+                logger.info(f"📊 Собрано {len(users)} пользователей из группы")
+        
+        if not all_users:
+            logger.warning("⚠️ Не удалось получить пользователей ни из одной группы")
+            return []
+        
+        logger.info(f"📊 Всего собрано {len(all_users)} пользователей из {groups_processed} групп")
+        
+        # Фильтрация
+        filtered_users = self.filter_users_advanced(all_users)
+        
+        if not filtered_users:
+            logger.warning("⚠️ Нет подходящих пользователей после фильтрации")
+        
+        return filtered_users
+    
+    def collect_candidates_streaming(self, all_groups, target_count, max_groups_per_cycle):
+        """Потоковый сбор кандидатов
+        
+        Страницы участников фильтруются по мере загрузки, случайные
+        target_count кандидатов выбираются reservoir sampling'ом. Загрузка
+        прекращается, как только набралось достаточно подходящих.
+        """
+        pool_size = target_count * max(1, self.config["stream_oversample"])
+        user_filter = self.compile_user_filter()
+        reservoir = []
+        seen_ids = set()
+        groups_processed = 0
+        total_loaded = 0
+        
+        for group in all_groups:
+            if groups_processed >= max_groups_per_cycle or len(seen_ids) >= pool_size:
+                break
+            
+            pages = self.iter_group_member_pages(group, max_count=500)
+            loaded = 0
+            for page, raw_count in pages:
+                # Считаем по ответу API, а не по оставшимся после кэша записям,
+                # чтобы лимит групп за цикл не зависел от MEMBER_CACHE_ENABLED
+                loaded += raw_count
+                
+                for user in self.filter_users_batch(page, user_filter):
+                    if user.id in seen_ids:
+                        continue
+                    seen_ids.add(user.id)
+                    
+                    # Reservoir sampling: каждый кандидат попадает в выборку
+                    # с равной вероятностью без хранения всего потока
+                    if len(reservoir) < target_count:
+                        reservoir.append(user)
+                    else:
+                        j = random.randrange(len(seen_ids))
+                        if j < target_count:
+                            reservoir[j] = user
+                
+                if len(seen_ids) >= pool_size:
+                    break
+            pages.close()
+            
+            if loaded:
+                groups_processed += 1
+                total_loaded += loaded
+                logger.info(f"📊 Просмотрено {loaded} пользователей из группы")
+        
+        if not total_loaded:
+            logger.warning("⚠️ Не удалось получить пользователей ни из одной группы")
+            return []
+        
+        logger.info(
+            f"📊 Просмотрено {total_loaded} пользователей из {groups_processed} групп, "
+            f"подходящих: {len(seen_ids)}"
+        )
+        
+        if not reservoir:
+            logger.warning("⚠️ Нет подходящих пользователей после фильтрации")
+        
+        # Перемешиваем только выборку
+        random.shuffle(reservoir)
+        return reservoir
+    
     def run_friend_requests_cycle(self):
         """Цикл отправки заявок в друзья"""
         logger.info("🚀 ЗАПУСК ЦИКЛА ЗАЯВОК В ДРУЗЬЯ")
@@ -507,48 +935,40 @@ class VKMedicalBot:
             logger.warning("⚠️ Нет доступных групп для поиска")
             return
         
-        # Собираем пользователей из нескольких групп
-        all_users = []
-        groups_processed = 0
         max_groups_per_cycle = 3  # Ограничиваем количество групп
         
-        for group in all_groups:
-            if groups_processed >= max_groups_per_cycle:
-                break
-                
-            users = self.get_group_members_safe(group, max_count=500)
-            if users:
-                all_users.extend(users)
-                groups_processed += 1
-                logger.info(f"📊 Собрано {len(users)} пользователей из группы")
-            
-            # Задержка между группами
-            time.sleep(5)
-        
-        if not all_users:
-            logger.warning("⚠️ Не удалось получить пользователей ни из одной группы")
-            return
-        
-        logger.info(f"📊 Всего собрано {len(all_users)} пользователей из {groups_processed} групп")
+        # Информация и доступность групп - одним пакетом (с запасом на недоступные)
+        self.prefetch_groups(all_groups[:max_groups_per_cycle * 2])
         
-        # Фильтрация
-        filtered_users = self.filter_users_advanced(all_users)
+        # Отбираем кандидатов
+        target_limit = min(requests_left, 10)  # Максимум 10 за раз
+        with self.profile("members", memory=True):
+            if self.config["streaming_pipeline"]:
+                filtered_users = self.collect_candidates_streaming(
+                    all_groups, target_limit, max_groups_per_cycle
+                )
+            else:
+                filtered_users = self.collect_candidates(all_groups, max_groups_per_cycle)
         
         if not filtered_users:
-            logger.warning("⚠️ Нет подходящих пользователей после фильтрации")
             return
         
         # Отправляем заявки
-        target_count = min(len(filtered_users), requests_left, 10)  # Максимум 10 за раз
+        target_count = min(len(filtered_users), target_limit)
         
         logger.info(f"🎯 Отправка {target_count} заявок")
         
         success_count = 0
         
         for i in range(target_count):
+            # После флуд-контроля или капчи заявки до конца паузы не отправляем
+            if not self.governor.available("friends.add"):
+                logger.warning("⏸️ Заявки приостановлены регулятором")
+                break
+            
             user = filtered_users[i]
             
-            if self.send_friend_request_safe(user["id"]):
+            if self.send_friend_request_safe(user.id):
                 success_count += 1
             
             # Задержка между заявками
@@ -563,33 +983,79 @@ class VKMedicalBot:
         logger.info(f"📈 РЕЗУЛЬТАТ: {success_count}/{target_count} успешных заявок")
         self.save_stats()
     
+    def profile(self, name, memory=False):
+        """Профилирование участка (ничего не делает, если PROFILE выключен)"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.section(name, memory=memory)
+    
+    @contextmanager
+    def span(self, phase):
+        """Фаза цикла: замер для метрик и профилирование (если включены)"""
+        timer = self.metrics.span(phase) if self.metrics is not None else nullcontext()
+        start = time.perf_counter()
+        try:
+            with timer, self.profile(phase):
+                yield
+        finally:
+            duration = time.perf_counter() - start
+            logger.info(
+                f"⏱️ Фаза {phase}: {duration:.2f} с",
+                extra={"phase": phase, "duration": round(duration, 3)}
+            )
+    
     def run_cycle(self):
         """Один цикл работы бота"""
         logger.info("🔄 НАЧАЛО ЦИКЛА РАБОТЫ")
         
-        try:
-            # Сброс дневных лимитов
-            self.reset_daily_counters()
-            
-            # 1. Поиск новых групп (если мало групп)
-            if len(self.stats["open_groups"]) < 10:
-                logger.info("🔍 Мало групп, ищем новые...")
-                self.discover_open_medical_groups()
-            
-            # 2. Проверка новых друзей
-            self.check_new_friends()
-            
-            # 3. Приглашение друзей в группу
-            self.invite_friends_to_group_safe()
-            
-            # 4. Отправка заявок в друзья
-            self.run_friend_requests_cycle()
-            
-            # Сохранение статистики
-            self.save_stats()
-            
-        except Exception as e:
-            logger.error(f"Ошибка в цикле: {e}")
+        with self.profile("cycle"):
+            try:
+                # Сброс дневных лимитов
+                self.reset_daily_counters()
+                
+                # 1. Поиск новых групп (если мало групп)
+                if len(self.stats["open_groups"]) < 10:
+                    logger.info("🔍 Мало групп, ищем новые...")
+                    with self.span("discovery"):
+                        self.discover_open_medical_groups()
+                
+                # 2. Проверка новых друзей
+                with self.span("check_new_friends"):
+                    self.check_new_friends()
+                
+                # 3. Приглашение друзей в группу
+                with self.span("invites"):
+                    self.invite_friends_to_group_safe()
+                
+                # 4. Отправка заявок в друзья
+                with self.span("friend_requests"):
+                    self.run_friend_requests_cycle()
+                
+                # Сохранение статистики
+                with self.span("save_stats"):
+                    self.save_stats()
+                
+            except Exception as e:
+                logger.error(f"Ошибка в цикле: {e}")
+        
+        # Попадания в кэш страниц участников за цикл
+        page_cache_stats = None
+        if self.page_cache is not None:
+            page_cache_stats = {"hits": self.page_cache.hits, "misses": self.page_cache.misses}
+            self.page_cache.hits = self.page_cache.misses = 0
+            logger.info(
+                f"🗂️ Кэш страниц участников: {page_cache_stats['hits']} попаданий, "
+                f"{page_cache_stats['misses']} промахов"
+            )
+        
+        if self.metrics is not None:
+            self.metrics.flush_cycle(
+                friend_requests_today=self.stats["friend_requests_today"],
+                invites_today=self.stats["invites_today"],
+                friends_to_invite=len(self.stats["friends_to_invite"]),
+                pending_requests=len(self.stats["friend_requests"]),
+                member_cache=page_cache_stats
+            )
         
         # Отчет
         logger.info(f"""
@@ -606,10 +1072,13 @@ class VKMedicalBot:
         """Непрерывная работа бота"""
         logger.info("🚀 ЗАПУСК БОТА В НЕПРЕРЫВНОМ РЕЖИМЕ")
         
-        # Поиск открытых групп при старте
-        if len(self.stats["open_groups"]) < 5:
+        # Первичный поиск открытых групп: при быстром старте - перед
+        # первым дневным циклом, а не сразу после запуска
+        startup_discovery = len(self.stats["open_groups"]) < 5
+        if startup_discovery and not self.config["fast_start"]:
             logger.info("🔍 Первичный поиск открытых групп...")
             self.discover_open_medical_groups()
+            startup_discovery = False
         
         while True:
             try:
@@ -617,6 +1086,12 @@ class VKMedicalBot:
                 current_hour = datetime.now().hour
                 
                 if 9 <= current_hour <= 21:  # Работаем с 9 до 21
+                    if startup_discovery:
+                        startup_discovery = False
+                        if len(self.stats["open_groups"]) < 5:
+                            logger.info("🔍 Первичный поиск открытых групп...")
+                            self.discover_open_medical_groups()
+                    
                     self.run_cycle()
                     
                     # Интервал между циклами (2-4 часа)
@@ -631,6 +1106,10 @@ class VKMedicalBot:
                     
             except KeyboardInterrupt:
                 logger.info("⏹️ Остановка по команде пользователя")
+                self.save_stats()
+                self.state.close()
+                if self.page_cache is not None:
+                    self.page_cache.close()
                 break
             except Exception as e:
                 logger.error(f"❌ Критическая ошибка: {e}")